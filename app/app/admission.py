@@ -0,0 +1,156 @@
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+import asyncio
+import json
+import os
+
+from celery import Celery, Task
+import redis.asyncio as redis
+
+ADMISSION_MAX_DEPTH = int(os.getenv("ADMISSION_MAX_DEPTH", "1000"))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "500"))
+# Per queue overrides, e.g. '{"ml_service": {"depth": 200, "in_flight": 100}}'
+ADMISSION_LIMITS = json.loads(os.getenv("ADMISSION_LIMITS", "{}"))
+ADMISSION_POLL_INTERVAL = float(os.getenv("ADMISSION_POLL_INTERVAL", "0.5"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))  # seconds
+
+# Kombu's Redis transport keeps messages with a priority in extra lists
+PRIORITY_SEP = "\x06\x16"
+PRIORITY_STEPS = [3, 6, 9]
+
+
+class Overloaded(Exception):
+    def __init__(self, queue: str, reason: str, status_code: int, retry_after: int):
+        super().__init__(f"Queue[{queue}] {reason}")
+        self.queue = queue
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Rejects work early instead of enqueuing it behind a backlog.
+
+    The depth of each queue is polled from the Redis broker every
+    `poll_interval` seconds, plus what this process enqueued since. Work for
+    a queue deeper than its `depth` limit is refused with 503, and requests
+    holding more than `in_flight` slots of a queue in this process with 429,
+    both with a `Retry-After`. A limit of 0 disables it.
+    """
+
+    def __init__(
+        self,
+        app: Celery,
+        limits: Optional[Dict[str, Dict[str, int]]] = None,
+        max_depth: int = ADMISSION_MAX_DEPTH,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+        poll_interval: float = ADMISSION_POLL_INTERVAL,
+        retry_after: int = ADMISSION_RETRY_AFTER,
+    ):
+        self.app = app
+        self.limits = ADMISSION_LIMITS if limits is None else limits
+        self.max_depth = max_depth
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.retry_after = retry_after
+        self.depth: Dict[str, int] = {}
+        self.in_flight: Dict[str, int] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._queues: Dict[str, str] = {}
+        self._redis: Optional[redis.Redis] = None
+        self._poller: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._redis = redis.Redis.from_url(self.app.conf.broker_url)
+        self._poller = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+        if self._redis is not None:
+            await self._redis.aclose()
+
+    def queue(self, task: Task) -> str:
+        """
+        Name of the queue `task` is routed to.
+        """
+        if task.name not in self._queues:
+            route = self.app.amqp.router.route({}, task.name)
+            self._queues[task.name] = route["queue"].name
+        return self._queues[task.name]
+
+    def limit(self, queue: str, kind: str) -> int:
+        default = self.max_depth if kind == "depth" else self.max_in_flight
+        return self.limits.get(queue, {}).get(kind, default)
+
+    @asynccontextmanager
+    async def admit(self, task: Task, count: int = 1):
+        """
+        Hold an in-flight slot of the queue of `task` for the duration of the
+        block, for enqueuing `count` tasks, or raise `Overloaded`.
+        """
+        queue = self.queue(task)
+        stats = self.stats.setdefault(
+            queue, {"admitted": 0, "rejected_depth": 0, "rejected_in_flight": 0}
+        )
+
+        max_depth = self.limit(queue, "depth")
+        if max_depth and self.depth.get(queue, 0) + count > max_depth:
+            stats["rejected_depth"] += 1
+            raise Overloaded(queue, "backlog", 503, self.retry_after)
+
+        max_in_flight = self.limit(queue, "in_flight")
+        if max_in_flight and self.in_flight.get(queue, 0) >= max_in_flight:
+            stats["rejected_in_flight"] += 1
+            raise Overloaded(
+                queue, "too many requests in flight", 429, self.retry_after
+            )
+
+        stats["admitted"] += 1
+        # Counted as queued until the next poll says otherwise
+        self.depth[queue] = self.depth.get(queue, 0) + count
+        self.in_flight[queue] = self.in_flight.get(queue, 0) + 1
+        try:
+            yield
+        finally:
+            self.in_flight[queue] -= 1
+
+    async def _poll_loop(self):
+        while True:
+            try:
+                await self.poll()
+            except redis.RedisError as e:
+                print(f"AdmissionController.poll() - error[{e}]")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll(self):
+        routes = self.app.conf.task_routes or {}
+        queues = sorted(
+            {route["queue"] for route in routes.values()}
+            | {self.app.conf.task_default_queue}
+            | set(self._queues.values())
+        )
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for queue in queues:
+                pipe.llen(queue)
+                for step in PRIORITY_STEPS:
+                    pipe.llen(f"{queue}{PRIORITY_SEP}{step}")
+            lengths = await pipe.execute()
+
+        n = 1 + len(PRIORITY_STEPS)
+        for i, queue in enumerate(queues):
+            self.depth[queue] = sum(lengths[i * n : (i + 1) * n])
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            queue: {
+                "depth": self.depth.get(queue, 0),
+                "in_flight": self.in_flight.get(queue, 0),
+                "max_depth": self.limit(queue, "depth"),
+                "max_in_flight": self.limit(queue, "in_flight"),
+                **self.stats.get(queue, {}),
+            }
+            for queue in sorted(set(self.depth) | set(self.stats))
+        }
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+
+import redis.asyncio as redis
+
+from ml.model import SpamModel
+from .celery_app.ml_tasks import DEFAULT_MODEL
+
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL = int(os.getenv("PREDICTION_CACHE_TTL", "3600"))  # seconds
+PREDICTION_CACHE_REDIS_URL = os.getenv(
+    "PREDICTION_CACHE_REDIS_URL",
+    os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0"),
+)
+ML_MODEL_VERSION = os.getenv("ML_MODEL_VERSION", "1")
+
+
+class PredictionCache:
+    """
+    Two-tier cache of spam predictions, keyed by the model name and version
+    and the preprocessed message: a bounded in-process LRU in front of a shared Redis
+    tier with a TTL. Redis errors are counted as misses.
+
+    Lookups use the latest `model_version` seen in a stored result of each
+    model, so once a worker serves a new version, entries of the previous
+    one are no longer hit.
+    """
+
+    prefix = "prediction-cache:"
+
+    def __init__(
+        self,
+        maxsize: int = PREDICTION_CACHE_SIZE,
+        ttl: int = PREDICTION_CACHE_TTL,
+        redis_url: Optional[str] = PREDICTION_CACHE_REDIS_URL,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self.versions: Dict[str, str] = {}
+        self._redis: Optional[redis.Redis] = None
+        self._local: OrderedDict[str, Any] = OrderedDict()
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "errors": 0}
+
+    @property
+    def redis(self) -> Optional[redis.Redis]:
+        if self._redis is None and self.redis_url:
+            self._redis = redis.Redis.from_url(self.redis_url)
+        return self._redis
+
+    def key(self, msg: str, model: str = DEFAULT_MODEL) -> str:
+        text = SpamModel.preprocessor(msg)
+        version = self.versions.get(model, ML_MODEL_VERSION)
+        return hashlib.sha256(f"{model}:{version}:{text}".encode()).hexdigest()
+
+    async def get(self, msg: str, model: str = DEFAULT_MODEL) -> Optional[Any]:
+        key = self.key(msg, model)
+        if key in self._local:
+            self._local.move_to_end(key)
+            self.stats["local_hits"] += 1
+            return self._local[key]
+
+        value = None
+        if self.redis is not None:
+            try:
+                value = await self.redis.get(self.prefix + key)
+            except redis.RedisError as e:
+                print(f"PredictionCache.get() - error[{e}]")
+                self.stats["errors"] += 1
+
+        if value is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["redis_hits"] += 1
+        value = json.loads(value)
+        self._put_local(key, value)
+        return value
+
+    async def set(self, msg: str, value: Dict[str, Any], model: str = DEFAULT_MODEL):
+        if value.get("model_version"):
+            self.versions[model] = value["model_version"]
+        key = self.key(msg, model)
+        self._put_local(key, value)
+        if self.redis is not None:
+            try:
+                await self.redis.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+            except redis.RedisError as e:
+                print(f"PredictionCache.set() - error[{e}]")
+                self.stats["errors"] += 1
+
+    def _put_local(self, key: str, value: Any):
+        if self.maxsize <= 0:
+            return
+        self._local[key] = value
+        self._local.move_to_end(key)
+        while len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+    def info(self) -> Dict[str, Any]:
+        lookups = sum(self.stats[k] for k in ("local_hits", "redis_hits", "misses"))
+        hits = self.stats["local_hits"] + self.stats["redis_hits"]
+        return {
+            **self.stats,
+            "size": len(self._local),
+            "maxsize": self.maxsize,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
@@ -0,0 +1,57 @@
+from celery import Celery
+import os
+
+
+class CeleryConfig:
+    broker_url = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+    result_backend = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+
+    # Celery routing, tasks not listed here go to the default `celery` queue
+    task_routes = {
+        "app.celery_app.ml_tasks.*": {
+            "queue": "ml_service",
+        },
+        "app.celery_app.email_tasks.*": {
+            "queue": "email_service",
+        },
+    }
+
+    # Longer than the longest `acks_late` task, or it is delivered again
+    broker_transport_options = {
+        "visibility_timeout": 36000,  # 10h
+        "max_connections": int(os.getenv("CELERY_BROKER_MAX_CONNECTIONS", "20")),
+    }
+    # Connections kept open for publishing, also the size of the producer pool
+    broker_pool_limit = int(os.getenv("CELERY_BROKER_POOL_LIMIT", "10"))
+    # Task events feed the web server's cluster monitor
+    worker_send_task_events = os.getenv("CELERY_TASK_EVENTS", "1") == "1"
+
+    # Connections of the Redis result backend client
+    redis_max_connections = int(os.getenv("CELERY_REDIS_MAX_CONNECTIONS", "20"))
+
+
+# One app for every task module, workers pick their tasks with `--queues`
+app = Celery(
+    include=[
+        "app.celery_app.tasks",
+        "app.celery_app.ml_tasks",
+        "app.celery_app.email_tasks",
+    ]
+)
+app.config_from_object(CeleryConfig)
+
+
+def setup_pools():
+    """
+    Open a broker connection from the pool and the result backend client,
+    so the first request does not pay for connecting.
+    """
+    with app.producer_pool.acquire(block=True) as producer:
+        producer.connection.ensure_connection(max_retries=3)
+    app.backend.client.ping()
+
+
+def close_pools():
+    app.producer_pool.force_close_all()
+    app.pool.force_close_all()
+    app.backend.client.connection_pool.disconnect()
@@ -1,4 +1,4 @@
-from celery import Celery, Task
+from celery import Task
 from email.utils import make_msgid
 from email.message import EmailMessage
 import smtplib
@@ -6,20 +6,7 @@ import os
 import sys
 import time
 
-
-class CeleryConfig:
-    broker_url = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
-    result_backend = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
-
-
-app = Celery()
-app.config_from_object(CeleryConfig)
-# Celery routing
-app.conf.task_routes = {
-    "app.celery_app.email_tasks.*": {
-        "queue": "email_service",
-    },
-}
+from .app import app
 
 
 @app.task(acks_late=True)
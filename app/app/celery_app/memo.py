@@ -0,0 +1,108 @@
+from typing import Any, Dict, Tuple
+import hashlib
+import inspect
+import json
+import os
+import time
+
+from celery import Task
+import redis
+
+MEMO_TTL = int(os.getenv("MEMO_TTL", str(7 * 24 * 3600)))  # seconds
+MEMO_MAX_ENTRIES = int(os.getenv("MEMO_MAX_ENTRIES", "10000"))
+
+
+def fingerprint(arguments: Dict[str, Any]) -> str:
+    """
+    Hash of the arguments of a task, by parameter name. An argument naming
+    an existing file stands for its content, by its size and modification
+    time, so a changed file is a new input while the same file under the
+    same path is not.
+    """
+
+    def content(value):
+        if isinstance(value, str) and os.path.isfile(value):
+            stat = os.stat(value)
+            return [value, stat.st_size, stat.st_mtime_ns]
+        return value
+
+    payload = json.dumps(
+        {name: content(value) for name, value in arguments.items()},
+        sort_keys=True,
+        default=repr,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class Memoized(Task):
+    """
+    Base of tasks whose result only depends on their arguments, opted in
+    with `@app.task(base=Memoized)`.
+
+    The result is stored in the Redis result backend under the task name and
+    the `fingerprint` of the arguments for `memo_ttl` seconds, and returned
+    as is when the task runs again with the same arguments, so a pipeline
+    sent again, e.g. after one of its steps failed, only runs the steps
+    missing. Failures are not stored. Past `MEMO_MAX_ENTRIES`, the entries
+    closest to expiring are evicted. Redis errors, or an entry that can't be
+    decoded, run the task as usual.
+
+    Nothing checks that a task is pure: the first result of one that is
+    not, e.g. `analyze_video`, is served as is until it expires.
+    """
+
+    prefix = "memo:"
+    index = "memo:index"  # Sorted set of the keys, by expiry
+    memo_ttl = MEMO_TTL
+
+    def memo_key(self, args: Tuple, kwargs: Dict[str, Any]) -> str:
+        # The same call, whether arguments are positional, keywords or defaults
+        try:
+            bound = inspect.signature(self.run).bind(*args, **kwargs)
+        except TypeError:
+            # Fails in the task as well, not stored
+            arguments = {"args": args, "kwargs": kwargs}
+        else:
+            bound.apply_defaults()
+            arguments = bound.arguments
+        return f"{self.prefix}{self.name}:{fingerprint(arguments)}"
+
+    def __call__(self, *args, **kwargs):
+        key = self.memo_key(args, kwargs)
+        client = self.backend.client
+        try:
+            value = client.get(key)
+        except redis.RedisError as e:
+            print(f"Memoized() - task[{self.name}] error[{e}]")
+            value = None
+        if value is not None:
+            try:
+                result = json.loads(value)
+            except ValueError as e:
+                print(f"Memoized() - task[{self.name}] bad entry[{key}] error[{e}]")
+            else:
+                print(f"Memoized() - task[{self.name}] hit[{key}]")
+                return result
+
+        result = super().__call__(*args, **kwargs)
+        try:
+            self._store(client, key, json.dumps(result))
+        except (TypeError, ValueError) as e:
+            print(f"Memoized() - task[{self.name}] not stored[{e}]")
+        except redis.RedisError as e:
+            print(f"Memoized() - task[{self.name}] error[{e}]")
+        return result
+
+    def _store(self, client: redis.Redis, key: str, value: str):
+        now = time.time()
+        with client.pipeline() as pipe:
+            pipe.set(key, value, ex=self.memo_ttl)
+            pipe.zadd(self.index, {key: now + self.memo_ttl})
+            pipe.zremrangebyscore(self.index, "-inf", now)
+            pipe.zcard(self.index)
+            size = pipe.execute()[-1]
+        if size > MEMO_MAX_ENTRIES:
+            evicted = [
+                k for k, _ in client.zpopmin(self.index, size - MEMO_MAX_ENTRIES)
+            ]
+            client.delete(*evicted)
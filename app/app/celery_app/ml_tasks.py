@@ -1,80 +1,235 @@
-from celery import Celery, Task
-import importlib.util
+from celery import Task, signals
+from celery_batches import Batches, SimpleRequest
+from celery.utils.time import maybe_iso8601, maybe_make_aware
+from celery.worker.control import inspect_command
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import collections
+import json
 import os
-import sys
 import time
 
+from .app import app
+from .model_host import ModelHost
 
-class CeleryConfig:
-    broker_url = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
-    result_backend = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+MODEL_DIR = os.path.abspath(os.path.join(__file__, "..", "..", "..", "ml"))
 
+# `compact` serves the memory-mapped NumPy export, see `ml/export_spam_detector.py`
+# `registry` serves and hot-swaps the current version of `ml/registry`, see `ml/publish_spam_detector.py`
+ML_MODEL_FORMAT = os.getenv("ML_MODEL_FORMAT", "joblib")
+MODEL_CLASS = {
+    "compact": "CompactSpamModel",
+    "registry": "RegistrySpamModel",
+}.get(ML_MODEL_FORMAT, "SpamModel")
+
+# Micro-batching of `detect_spam` requests, see `detect_spam_batch`
+ML_BATCH_ENABLED = os.getenv("ML_BATCH_ENABLED", "false").lower() in ("1", "true")
+ML_BATCH_MAX_SIZE = int(os.getenv("ML_BATCH_MAX_SIZE", "32"))
+ML_BATCH_WINDOW = float(os.getenv("ML_BATCH_WINDOW", "0.05"))  # seconds
+
+# Load and warm up models in `worker_init`, before the worker consumes `ml_service`
+ML_PRELOAD = os.getenv("ML_PRELOAD", "false").lower() in ("1", "true")
+# Touched once the worker is ready, e.g. for a container readiness probe
+ML_READY_FILE = os.getenv("ML_READY_FILE")
+WARMUP_MESSAGES = ["Hello, how are you?", "WINNER!! Claim your free prize now :-)"]
+
+# Models served by name, besides `spam` more can be added as JSON, e.g.
+# {"phishing": ["/usr/src/app/ml", "model", "SpamModel", {"path": "/models/phishing.joblib"}]}
+DEFAULT_MODEL = "spam"
+ML_MODELS = json.loads(os.getenv("ML_MODELS", "{}"))
+# Total estimated size of resident models, least recently used ones are evicted above it
+ML_MEMORY_BUDGET_MB = float(os.getenv("ML_MEMORY_BUDGET_MB", "0"))  # 0 is unbounded
+
+model_host = ModelHost(
+    {DEFAULT_MODEL: (MODEL_DIR, "model", MODEL_CLASS), **ML_MODELS},
+    memory_budget=int(ML_MEMORY_BUDGET_MB * 2**20),
+)
 
-app = Celery()
-app.config_from_object(CeleryConfig)
-# Celery routing
-app.conf.task_routes = {
-    "app.celery_app.ml_tasks.*": {
-        "queue": "ml_service",
-    },
-}
-app.conf.broker_transport_options = {"visibility_timeout": 36000}  # 1h
-
-MODEL_DIR = os.path.abspath(os.path.join(__file__, "..", "..", "..", "ml"))
+# Expired requests dropped before reaching a model, by task name. Counted in
+# the process running the task, which for `detect_spam_batch` is a pool child
+# unless the worker runs `--pool=solo`
+shed = collections.Counter()
 
 
 class PredictTask(Task):
     """
     Abstraction of Celery's Task class to support loading ML model.
+
+    Models are loaded on first use (i.e. first task processed) by the shared
+    `model_host`, which avoids the need to load them on each task request.
     """
 
     abstract = True
 
+    # Model used when a request does not name one
+    model_name = DEFAULT_MODEL
+
     def __init__(self):
         super().__init__()
-        self.model = None
         print("PredictTask initialized")
 
-    def __call__(self, *args, **kwargs):
-        """
-        Load model on first call (i.e. first task processed)
-        Avoids the need to load model on each task request
-        """
-        if not self.model:
-            print("Loading Model...")
-            print(self.path)
-            sys.path.insert(0, self.path[0])
+    @property
+    def model(self):
+        return model_host.get(self.model_name)
 
-            # NOTE: Use `parent_package.package`, so for getting `model.py`, it should be `mock_model.model`
+    def get_model(self, name: Optional[str] = None):
+        return model_host.get(name or self.model_name)
 
-            spec = importlib.util.find_spec(self.path[1])
-            print(spec)
-            # Or
-            # spec = util.spec_from_file_location("mock_model.model", self.model_file)
-            module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(module)
 
-            assert getattr(
-                module, self.path[2]
-            ), f"{self.path[2]} Class Not Found in {module}!"
+def warmup(model):
+    """
+    Run dummy predictions over a few batch sizes, so the first real request
+    does not pay for lazy imports, allocator growth and BLAS initialization.
+    """
+    for size in (1, 8, ML_BATCH_MAX_SIZE):
+        model.predict_many(WARMUP_MESSAGES * size)
 
-            # Initialize an instance
-            model_class = getattr(module, self.path[2])
-            self.model = model_class()
 
-            print("Model loaded")
-        return self.run(*args, **kwargs)
+class BatchPredictTask(PredictTask, Batches):
+    """
+    `PredictTask` whose messages are buffered by the worker and handed to
+    `run` as a list of `SimpleRequest`, flushed every `flush_interval` seconds
+    or as soon as `flush_every` messages are waiting.
+    """
+
+    abstract = True
 
 
 @app.task(
     ignore_result=False,
     bind=True,
     base=PredictTask,
-    path=(MODEL_DIR, "model", "SpamModel"),
 )
-def detect_spam(self, msg: str):
+def detect_spam(self, msg: str, model: Optional[str] = None):
     """
     Essentially the run method of PredictTask
     """
-    result = self.model.predict(msg)
+    result = self.get_model(model).predict(msg)
+    return result
+
+
+@app.task(
+    ignore_result=False,
+    bind=True,
+    base=PredictTask,
+)
+def detect_spam_many(self, msgs: List[str], model: Optional[str] = None):
+    """
+    Score a list of messages in one task, results are returned in order.
+    """
+    result = self.get_model(model).predict_many(msgs)
     return result
+
+
+@app.task(
+    bind=True,
+    base=BatchPredictTask,
+    flush_every=ML_BATCH_MAX_SIZE,
+    flush_interval=ML_BATCH_WINDOW,
+)
+def detect_spam_batch(self, requests: List[SimpleRequest]):
+    """
+    Batched variant of `detect_spam`, called as `detect_spam_batch.delay(msg)`.
+
+    All buffered messages for the same model are scored with one vectorized
+    `predict_many` call, then every result is stored under the id of the
+    request it belongs to, so each caller gets back a regular `AsyncResult`.
+    """
+    batches: Dict[str, List[SimpleRequest]] = {}
+    now = datetime.now(timezone.utc)
+    for request in requests:
+        # Unlike the default strategy, buffered requests are not checked for expiry
+        expires = request.request_dict.get("expires")
+        if expires and maybe_make_aware(maybe_iso8601(expires)) <= now:
+            shed[self.name] += 1
+            self.backend.mark_as_revoked(request.id, "expired", request=request)
+            continue
+        model = request.kwargs.get("model") or self.model_name
+        batches.setdefault(model, []).append(request)
+
+    for model, batch in batches.items():
+        messages = [r.args[0] if r.args else r.kwargs["msg"] for r in batch]
+        print(f"detect_spam_batch() - model[{model}] batch size[{len(messages)}]")
+
+        try:
+            results = self.get_model(model).predict_many(messages)
+        except Exception as exc:
+            for request in batch:
+                # `SimpleRequest` has no errbacks, looking for them would raise
+                self.backend.mark_as_failure(
+                    request.id, exc, request=request, call_errbacks=False
+                )
+            continue
+
+        for request, result in zip(batch, results):
+            self.backend.mark_as_done(request.id, result, request=request)
+
+
+@signals.task_revoked.connect
+def count_expired(sender, request, expired=False, **kwargs):
+    """
+    The worker revokes expired `detect_spam` requests itself, before running
+    them, count those.
+    """
+    if expired and isinstance(sender, PredictTask):
+        shed[sender.name] += 1
+
+
+ML_QUEUE = app.conf.task_routes["app.celery_app.ml_tasks.*"]["queue"]
+# Whether this worker consumes `ML_QUEUE`, every worker shares the app
+ml_worker = False
+
+
+@signals.worker_init.connect
+def preload_models(sender, **kwargs):
+    """
+    Load and warm up every model before the consumer starts, with prefork
+    the children are forked afterwards and share the loaded model.
+    """
+    global ml_worker
+    # Before routing a task adds the queue to the ones of a worker without `-Q`
+    ml_worker = ML_QUEUE in sender.app.amqp.queues.consume_from
+    if not ml_worker:
+        return
+
+    # A batch can only be filled from messages the worker has already reserved,
+    # set on the ml worker alone, the shared app would raise it for every worker
+    if ML_BATCH_ENABLED and sender.prefetch_multiplier < ML_BATCH_MAX_SIZE:
+        print(
+            f"preload_models() - prefetch[{sender.prefetch_multiplier}] is below"
+            f" ML_BATCH_MAX_SIZE[{ML_BATCH_MAX_SIZE}], start the ml worker with"
+            f" --prefetch-multiplier={ML_BATCH_MAX_SIZE}"
+        )
+    if not ML_PRELOAD:
+        return
+
+    for name in model_host.catalog:
+        start = time.perf_counter()
+        warmup(model_host.get(name))
+        print(f"preload_models() - model[{name}] {time.perf_counter() - start:.2f}s")
+
+
+@signals.worker_ready.connect
+def report_ready(sender, **kwargs):
+    if not ml_worker:
+        return
+
+    print("ml worker ready")
+    if ML_READY_FILE:
+        with open(ML_READY_FILE, "w") as f:
+            f.write(str(os.getpid()))
+
+
+@signals.worker_shutdown.connect
+def report_shutdown(sender, **kwargs):
+    if ml_worker and ML_READY_FILE and os.path.exists(ML_READY_FILE):
+        os.remove(ML_READY_FILE)
+
+
+@inspect_command()
+def model_stats(state):
+    """
+    Per-model load time, estimated resident size and eviction counts, and the
+    expired requests shed per task, e.g. `app.control.broadcast("model_stats", reply=True)`.
+    """
+    return {**model_host.info(), "shed": dict(shed)}
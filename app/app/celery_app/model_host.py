@@ -0,0 +1,149 @@
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+import importlib.util
+import sys
+import threading
+import time
+import types
+
+
+def load_model_class(path: Tuple):
+    """
+    Import `path[2]` from module `path[1]` in directory `path[0]` and
+    initialize it with the optional keyword arguments in `path[3]`.
+    """
+    print("Loading Model...")
+    print(path)
+    if path[0] not in sys.path:
+        sys.path.insert(0, path[0])
+
+    # NOTE: Use `parent_package.package`, so for getting `model.py`, it should be `mock_model.model`
+
+    spec = importlib.util.find_spec(path[1])
+    print(spec)
+    # Or
+    # spec = util.spec_from_file_location("mock_model.model", self.model_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    assert getattr(module, path[2]), f"{path[2]} Class Not Found in {module}!"
+
+    # Initialize an instance
+    model_class = getattr(module, path[2])
+    kwargs = path[3] if len(path) > 3 else {}
+    model = model_class(**kwargs)
+
+    print("Model loaded")
+    return model
+
+
+def estimate_size(obj: Any) -> int:
+    """
+    Approximate resident bytes of a model: NumPy buffers plus the Python
+    objects reachable from it. Code objects, classes and modules are skipped.
+    """
+    import numpy as np
+
+    skip = (
+        type,
+        types.ModuleType,
+        types.FunctionType,
+        types.MethodType,
+        types.BuiltinFunctionType,
+    )
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, skip):
+            continue
+        seen.add(id(o))
+
+        if isinstance(o, np.ndarray):
+            # Views share the buffer of their base
+            if isinstance(o.base, np.ndarray):
+                stack.append(o.base)
+            else:
+                total += o.nbytes
+            continue
+
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif hasattr(o, "__dict__"):
+            stack.append(o.__dict__)
+    return total
+
+
+class ModelHost:
+    """
+    Loads models on demand by name and keeps the resident ones within a
+    memory budget, evicting the least recently used first.
+
+    `catalog` maps a model name to the `path` of its class, as accepted by
+    `load_model_class`. A `memory_budget` of 0 never evicts.
+    """
+
+    def __init__(self, catalog: Dict[str, Tuple], memory_budget: int = 0):
+        self.catalog = dict(catalog)
+        self.memory_budget = memory_budget
+        self._models: OrderedDict[str, Any] = OrderedDict()
+        self._lock = threading.RLock()
+        self.stats: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, name: str, path: Tuple):
+        self.catalog[name] = path
+
+    def get(self, name: str) -> Any:
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                self.stats[name]["hits"] += 1
+                return self._models[name]
+
+            if name not in self.catalog:
+                raise KeyError(f"Model[{name}] is not in the catalog")
+
+            start = time.perf_counter()
+            model = load_model_class(self.catalog[name])
+            stats = self.stats.setdefault(name, {"loads": 0, "hits": 0, "evictions": 0})
+            stats["loads"] += 1
+            stats["load_time"] = time.perf_counter() - start
+            stats["size"] = estimate_size(model)
+            print(
+                f"ModelHost.get() - model[{name}] load_time[{stats['load_time']:.2f}s] size[{stats['size']}]"
+            )
+
+            self._models[name] = model
+            self._evict(keep=name)
+            return model
+
+    def _evict(self, keep: str):
+        if self.memory_budget <= 0:
+            return
+        for name in list(self._models):
+            if self.resident_size() <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            del self._models[name]
+            self.stats[name]["evictions"] += 1
+            print(f"ModelHost._evict() - model[{name}]")
+
+    def resident_size(self) -> int:
+        return sum(self.stats[name]["size"] for name in self._models)
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "memory_budget": self.memory_budget,
+                "resident_size": self.resident_size(),
+                "models": {
+                    name: {**self.stats.get(name, {}), "resident": name in self._models}
+                    for name in self.catalog
+                },
+            }
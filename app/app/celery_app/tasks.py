@@ -1,28 +1,28 @@
-from celery import Celery, Task, chord, group, subtask, chain
-from celery.result import AsyncResult, GroupResult, allow_join_result
+from celery import Task, chord
+from celery.exceptions import Ignore
 from celery.canvas import Signature
-from typing import List, Any
+from typing import List, Any, Dict, Iterable
+import csv
+import itertools
+import json
 import os
 import sys
 import time
 import math
-import uuid
 
+from .app import app
+from .memo import Memoized
+from .workflow import Workflow, WORKFLOW_MAX_PARALLEL
 
-class CeleryConfig:
-    broker_url = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
-    result_backend = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
-
-
-app = Celery()
-app.config_from_object(CeleryConfig)
-# Celery routing
-# app.conf.task_routes = {
-#     'app.celery_app.email_tasks.*': {
-#         'queue': 'email_service',
-#     },
-# }
-app.conf.broker_transport_options = {"visibility_timeout": 3600}
+# Elements per message of `chunked`
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "100"))
+# Elements per `map_chunk` task and tasks per `reduce` of `mapreduce`
+MAPREDUCE_CHUNK_SIZE = int(os.getenv("MAPREDUCE_CHUNK_SIZE", "1000"))
+MAPREDUCE_FAN_IN = int(os.getenv("MAPREDUCE_FAN_IN", "16"))
+# `score_csv` only reads and writes files of this directory
+CSV_DATA_DIR = os.getenv(
+    "CSV_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "..", "ml", "data")
+)
 
 
 @app.task()
@@ -84,7 +84,7 @@ def mul(self, x: float, y: float):
     return total
 
 
-@app.task(bind=True)
+@app.task(bind=True, base=Memoized)
 def convert_video(self, video_path: str) -> str:
     print(f"convert_video() - task[{self.request.id}], video_path[{video_path}]")
     time.sleep(10)
@@ -96,8 +96,12 @@ def convert_video(self, video_path: str) -> str:
     return output_video_path
 
 
-@app.task(bind=True)
+@app.task(bind=True, base=Memoized)
 def analyze_video(self, video_path: str) -> List[int]:
+    """
+    Frames to clip, picked at random in this demo. Memoized all the same, so
+    a pipeline sent again clips the frames it found the first time.
+    """
     import random
 
     print(f"convert_video() - task[{self.request.id}], video_path[{video_path}]")
@@ -107,7 +111,7 @@ def analyze_video(self, video_path: str) -> List[int]:
     return frames
 
 
-@app.task(bind=True)
+@app.task(bind=True, base=Memoized)
 def mark_video(self, video_path: str) -> str:
     print(f"mark_video() - task[{self.request.id}], video_path[{video_path}")
     time.sleep(10)
@@ -117,7 +121,7 @@ def mark_video(self, video_path: str) -> str:
     return mark_video_path
 
 
-@app.task(bind=True)
+@app.task(bind=True, base=Memoized)
 def clip_video(self, video_path: str, frame: int) -> str:
     print(
         f"clip_video() - task[{self.request.id}], video_path[{video_path} frame[{frame}]"
@@ -131,68 +135,34 @@ def clip_video(self, video_path: str, frame: int) -> str:
     return clipped_video_path
 
 
-@app.task(bind=True)
-def clip_videos(self: Task, video_path: str, frames: List[int]):
-    print(
-        f"clip_video() - task[{self.request.id}], video_path[{video_path}] frames[{frames}]"
+def video_workflow(
+    video_path: str, max_parallel: int = WORKFLOW_MAX_PARALLEL
+) -> Workflow:
+    """
+    Convert and analyze the video, then mark the converted video and clip
+    it at each frame found by the analysis.
+    """
+    return Workflow(
+        nodes={
+            "convert": convert_video.s(video_path=video_path),
+            "analyze": analyze_video.s(video_path=video_path),
+            "mark": mark_video.s(),
+            "clip": clip_video.s(),
+        },
+        edges={
+            "convert": ["mark", "clip"],
+            "analyze": ["clip"],
+        },
+        foreach={"clip": "analyze"},
+        max_parallel=max_parallel,
     )
 
-    subtasks: List[Signature] = []
-    for frame in frames:
-        t: Signature = clip_video.s(video_path=video_path, frame=frame).set(
-            task_id=str(uuid.uuid4())
-        )
-        subtasks.append(t)
-
-    g: Signature = group(subtasks)
-
-    # To make the `g` be trackable, save the group result
-    # After that, we can get the result by `GroupResult.restore(g_id)`
-    g_result: GroupResult = GroupResult(
-        id=self.request.id, results=[AsyncResult(id=t.id) for t in subtasks]
-    )
-    g_result.save()
-
-    # Replace clip_videos with `g` task.
-    # Inside this step, the `g` will be `apply_async()`.
-    # So there is no need to call `apply_async()`
-    self.replace(g)
-    # code will not execute after `replace()`
-    return
-
-
-@app.task(bind=True)
-def dmap_video(self, result, t4, t5):
-    output_video = result[0]
-    frames = result[1]
-
-    t4 = subtask(t4)
-    t5 = subtask(t5)
-
-    t4: Signature = t4.clone(args=(output_video,))
-    t5: Signature = t5.clone(args=(output_video, frames))
-
-    g = group(t4, t5)
-    self.replace(g)
-
 
 @app.task(bind=True)
 def pipeline(self: Task, video_path: str):
-    input_video = video_path
-    t1: Signature = convert_video.s(video_path=input_video).set(
-        task_id=str(uuid.uuid4())
-    )
-    t2: Signature = analyze_video.s(video_path=input_video).set(
-        task_id=str(uuid.uuid4())
-    )
-
-    t4: Signature = mark_video.s().set(task_id=str(uuid.uuid4()))
-    t5: Signature = clip_videos.s().set(task_id=str(uuid.uuid4()))
-
-    workflow: Signature = chain(group(t1, t2), dmap_video.s(t4, t5))
-    # res: AsyncResult = workflow.apply_async()
-
-    return self.replace(workflow)
+    video_workflow(video_path).apply_async(workflow_id=self.request.id)
+    # The workflow stores its result under the id of this task, when done
+    raise Ignore()
 
 
 @app.task(name="celery.notify", shared=False, ignore_result=True)
@@ -200,14 +170,30 @@ def notify(mgs: str):
     print(f"notify() - mgs[{mgs}]")
 
 
+def measure(data: str) -> int:
+    """
+    What `map` computes for one element, shared with the tasks mapping many.
+    """
+    return len(data)
+
+
 @app.task(ignore_result=False)
 def map(data: str) -> int:
     print(f"map() - task[{app.current_task.request.id}] data[{data}]")
     time.sleep(3)
-    size = len(data)
+    size = measure(data)
     return size
 
 
+@app.task()
+def length(data: str) -> int:
+    """
+    `map` without its demo delay or logging, the tiny element-wise task to
+    run with `chunked`.
+    """
+    return measure(data)
+
+
 @app.task()
 def reduce(counts: List[int]) -> int:
     print(f"reduce() - task[{app.current_task.request.id}] counts[{counts}]")
@@ -218,30 +204,239 @@ def reduce(counts: List[int]) -> int:
 
 
 @app.task()
-def mapreduce(data: List[str]):
-    print(f"mapreduce() - task[{app.current_task.request.id}] data[{data}]")
-    job = group([map.s(x) for x in data])
-    task: AsyncResult = job.delay()
-    with allow_join_result():
-        result = task.get()
-    # task.get(disable_sync_subtasks=False)
-    print(f"mapreduce() - result[{result}]")
-    return result
+def flatten(chunks: List[List[Any]]) -> List[Any]:
+    return [result for chunk in chunks for result in chunk]
+
+
+def chunked(
+    task: Task, items: Iterable[Any], chunk_size: int = CHUNK_SIZE
+) -> Signature:
+    """
+    Signature calling `task` on each of `items`, `chunk_size` calls per
+    message, executed in a row by the worker. Its result is the list of the
+    results of each call, in order, e.g. `chunked(length, data).delay().get()`.
+    The chunks go to the queue `task` is routed to.
+    """
+    queue = app.amqp.router.route({}, task.name)["queue"].name
+    calls = task.chunks([(item,) for item in items], chunk_size).group()
+    for call in calls.tasks:
+        # `celery.starmap` messages, routed to the default queue otherwise
+        call.set(queue=queue)
+    return chord(calls, flatten.s())
 
 
 @app.task()
-def dmap(results, t4, t5, t6):
-    # Map a task over an result and return as a group
-
-    # subtask is a task with parameters passed, but not yet started.
-    t4 = subtask(t4)
-    t5 = subtask(t5)
-    t6 = subtask(t6)
-
-    print(results[0])
-    # iterating over result and cloning task
-    header = [t4.clone((results[0],))]
-    header.extend([t5.clone((arg,)) for arg in results[1]])
-    task = chord(header=header, body=t6)
-    result = task.apply_async()
-    return result
+def map_chunk(chunk: List[str]) -> int:
+    """
+    `map` over a chunk of the input of `mapreduce`, combined in place.
+    """
+    print(f"map_chunk() - task[{app.current_task.request.id}] size[{len(chunk)}]")
+    return sum(measure(data) for data in chunk)
+
+
+def reduce_tree(header: List[Signature], fan_in: int) -> Signature:
+    """
+    Chord reducing the results of `header` with `reduce`, through levels of
+    chords of at most `fan_in` tasks each, so no callback joins them all.
+    """
+    while len(header) > fan_in:
+        header = [
+            chord(header[i : i + fan_in], reduce.s())
+            for i in range(0, len(header), fan_in)
+        ]
+    return chord(header, reduce.s())
+
+
+@app.task(bind=True)
+def mapreduce(
+    self: Task,
+    data: List[str],
+    chunk_size: int = MAPREDUCE_CHUNK_SIZE,
+    fan_in: int = MAPREDUCE_FAN_IN,
+):
+    """
+    Total size of `data`, mapped by `map_chunk` in chunks of `chunk_size`
+    and reduced by a tree of chords. The task is replaced by that workflow
+    rather than waiting for it, so it holds no worker slot meanwhile.
+    """
+    print(f"mapreduce() - task[{self.request.id}] size[{len(data)}]")
+    if not data:
+        return 0
+
+    header = [
+        map_chunk.s(data[i : i + chunk_size]) for i in range(0, len(data), chunk_size)
+    ]
+    return self.replace(reduce_tree(header, fan_in))
+
+
+def data_path(name: str) -> str:
+    """
+    Path of the file `name` in `CSV_DATA_DIR`, raises `ValueError` if it
+    resolves outside of it, e.g. an absolute path, `..` or a symlink.
+    """
+    root = os.path.realpath(CSV_DATA_DIR)
+    path = os.path.realpath(os.path.join(root, name))
+    if path == root or os.path.commonpath([root, path]) != root:
+        raise ValueError(f"File[{name}] is not in the data directory")
+    return path
+
+
+@app.task(bind=True, acks_late=True)
+def score_csv(
+    self: Task,
+    input_file: str,
+    output_file: str,
+    column: str = "Message",
+    chunk_size: int = 1000,
+    max_in_flight: int = 4,
+    model: str = "spam",
+):
+    """
+    Score every row of `input_file` with `ml_tasks.detect_spam_many`, one
+    chunk of `chunk_size` rows per task on `ml_service`, and write the rows
+    with their predictions to `output_file` in input order. Both are files
+    of `CSV_DATA_DIR`.
+
+    Rows are scored `max_in_flight` chunks at a time, by a chord whose body,
+    `score_csv_window`, writes them and sends the next chord, so memory stays
+    bounded and no worker waits on another task. The state and result of
+    the job are stored under the id of this task, when done.
+    `output_file.checkpoint` records the rows written so far and the
+    matching input and output offsets, a re-submitted job resumes from there.
+    """
+    if chunk_size < 1 or max_in_flight < 1:
+        raise ValueError(
+            f"chunk_size[{chunk_size}] and max_in_flight[{max_in_flight}] must be"
+            " positive"
+        )
+    input_path, output_path = data_path(input_file), data_path(output_file)
+    with open(input_path, newline="") as f:
+        total = sum(1 for _ in csv.reader(f)) - 1
+
+    checkpoint = {"rows": 0, "offset": 0, "input_offset": 0}
+    checkpoint_path = f"{output_path}.checkpoint"
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    print(
+        f"score_csv() - task[{self.request.id}] resume from row[{checkpoint['rows']}]"
+    )
+
+    job = {
+        "job_id": self.request.id,
+        "input_file": input_file,
+        "output_file": output_file,
+        "column": column,
+        "chunk_size": chunk_size,
+        "max_in_flight": max_in_flight,
+        "model": model,
+        "total": total,
+    }
+    self.update_state(
+        state="PROGRESS", meta={"current": checkpoint["rows"], "total": total}
+    )
+    _score_csv_next(job, checkpoint)
+    raise Ignore()
+
+
+def _read_rows(path: str, offset: int, count: int):
+    """
+    Header of the CSV file `path` and up to `count` rows from `offset`, 0 is
+    the first row, with the offset of the row after them.
+    """
+    with open(path, newline="") as f:
+        fieldnames = next(csv.reader([f.readline()]))
+        if offset:
+            f.seek(offset)
+        # `readline`, unlike iterating the file, keeps `tell()` usable
+        reader = csv.DictReader(iter(f.readline, ""), fieldnames=fieldnames)
+        rows = list(itertools.islice(reader, count))
+        return fieldnames, rows, f.tell()
+
+
+def _score_csv_next(job: Dict[str, Any], checkpoint: Dict[str, int]):
+    from . import ml_tasks
+
+    _, rows, input_offset = _read_rows(
+        data_path(job["input_file"]),
+        checkpoint["input_offset"],
+        job["chunk_size"] * job["max_in_flight"],
+    )
+    if not rows:
+        print(f"score_csv() - task[{job['job_id']}] scored rows[{checkpoint['rows']}]")
+        app.backend.mark_as_done(
+            job["job_id"],
+            {"rows": checkpoint["rows"], "output_file": job["output_file"]},
+        )
+        return
+
+    size = job["chunk_size"]
+    header = [
+        ml_tasks.detect_spam_many.s(
+            [row[job["column"]] for row in rows[i : i + size]], model=job["model"]
+        )
+        for i in range(0, len(rows), size)
+    ]
+    body = score_csv_window.s(job, checkpoint, input_offset)
+    body.link_error(score_csv_failed.s(job["job_id"]))
+    chord(header, body).apply_async()
+
+
+@app.task()
+def score_csv_window(
+    predictions: List[List[Dict[str, Any]]],
+    job: Dict[str, Any],
+    checkpoint: Dict[str, int],
+    input_offset: int,
+):
+    """
+    Write the rows of a window of `score_csv` with their predictions, record
+    the checkpoint and score the next window.
+    """
+    predictions = [prediction for chunk in predictions for prediction in chunk]
+    fieldnames, rows, _ = _read_rows(
+        data_path(job["input_file"]), checkpoint["input_offset"], len(predictions)
+    )
+    output_path = data_path(job["output_file"])
+
+    with open(output_path, "a+", newline="") as fout:
+        writer = csv.DictWriter(
+            fout, fieldnames=fieldnames + ["label", "spam_probability", "model_version"]
+        )
+        # Drop rows written after the last checkpoint
+        fout.truncate(checkpoint["offset"])
+        fout.seek(checkpoint["offset"])
+        if checkpoint["offset"] == 0:
+            writer.writeheader()
+        for row, prediction in zip(rows, predictions):
+            writer.writerow({**row, **prediction})
+        fout.flush()
+        os.fsync(fout.fileno())
+        offset = fout.tell()
+
+    checkpoint = {
+        "rows": checkpoint["rows"] + len(rows),
+        "offset": offset,
+        "input_offset": input_offset,
+    }
+    checkpoint_path = f"{output_path}.checkpoint"
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+    app.backend.store_result(
+        job["job_id"],
+        {"current": checkpoint["rows"], "total": job["total"]},
+        "PROGRESS",
+    )
+    _score_csv_next(job, checkpoint)
+
+
+@app.task()
+def score_csv_failed(request, exc, traceback, job_id: str):
+    """
+    Error callback of the chords of `score_csv`, fails the job.
+    """
+    print(f"score_csv() - task[{job_id}] failed[{exc!r}]")
+    app.backend.mark_as_failure(job_id, exc)
@@ -0,0 +1,270 @@
+from celery import signature, states
+from celery.canvas import Signature
+from celery.result import AsyncResult
+from typing import Any, Dict, List, Optional
+import json
+import os
+import uuid
+
+from .app import app
+
+# At most this many tasks of a workflow are queued or running at once
+WORKFLOW_MAX_PARALLEL = int(os.getenv("WORKFLOW_MAX_PARALLEL", "8"))
+WORKFLOW_TTL = int(os.getenv("WORKFLOW_TTL", str(24 * 3600)))  # seconds
+
+
+class Workflow:
+    """
+    DAG of task signatures, started without anyone waiting on it.
+
+    `edges` is the adjacency list, each node to the nodes depending on it.
+    A node is sent as soon as all its parents are done, with their results
+    as positional arguments, in the order the parents appear in `edges`.
+    A node in `foreach`, mapped to one of its parents, is sent once per item
+    of that parent's result instead, its result is the list of the results.
+
+    The state lives in the Redis result backend and every finished task
+    advances it from its `link` callback, so neither workers nor clients
+    poll. The workflow id is a result id, its result is the result of each
+    node without children, e.g. with `t1 + t2 > t3 > t4 + (t5 per item) > t6`:
+
+        Workflow(
+            nodes={"t1": ..., "t2": ..., "t3": ..., "t4": ..., "t5": ..., "t6": ...},
+            edges={"t1": ["t3"], "t2": ["t3"], "t3": ["t4", "t5"], "t4": ["t6"], "t5": ["t6"]},
+            foreach={"t5": "t3"},
+        ).apply_async().get()
+    """
+
+    def __init__(
+        self,
+        nodes: Dict[str, Signature],
+        edges: Dict[str, List[str]],
+        foreach: Optional[Dict[str, str]] = None,
+        max_parallel: int = WORKFLOW_MAX_PARALLEL,
+    ):
+        self.nodes = nodes
+        self.foreach = foreach or {}
+        self.max_parallel = max_parallel
+        self.children = {node: [] for node in nodes}
+        self.parents = {node: [] for node in nodes}
+        for parent, children in edges.items():
+            for child in children:
+                if parent not in nodes or child not in nodes:
+                    raise ValueError(f"Edge[{parent} -> {child}] to an unknown node")
+                self.children[parent].append(child)
+                self.parents[child].append(parent)
+        self._validate()
+
+    def _validate(self):
+        if not self.nodes:
+            raise ValueError("Workflow has no nodes")
+        for node, parent in self.foreach.items():
+            if parent not in self.parents.get(node, []):
+                raise ValueError(f"Node[{node}] maps over [{parent}], not a parent")
+        if self.max_parallel < 1:
+            raise ValueError("max_parallel must be at least 1")
+
+        # Kahn's algorithm, whatever is never freed is on a cycle
+        pending = {node: len(parents) for node, parents in self.parents.items()}
+        ready = [node for node, count in pending.items() if count == 0]
+        seen = 0
+        while ready:
+            node = ready.pop()
+            seen += 1
+            for child in self.children[node]:
+                pending[child] -= 1
+                if pending[child] == 0:
+                    ready.append(child)
+        if seen < len(self.nodes):
+            raise ValueError("Workflow has a cycle")
+
+    def spec(self) -> Dict[str, Any]:
+        return {
+            "nodes": {name: dict(sig) for name, sig in self.nodes.items()},
+            "parents": self.parents,
+            "children": self.children,
+            "foreach": self.foreach,
+        }
+
+    def apply_async(self, workflow_id: Optional[str] = None) -> AsyncResult:
+        workflow_id = workflow_id or str(uuid.uuid4())
+        keys = Keys(workflow_id)
+        client = app.backend.client
+
+        with client.pipeline() as pipe:
+            pipe.set(keys.spec, json.dumps(self.spec()), ex=WORKFLOW_TTL)
+            pipe.set(keys.left, len(self.nodes), ex=WORKFLOW_TTL)
+            pipe.hset(
+                keys.pending,
+                mapping={node: len(p) for node, p in self.parents.items()},
+            )
+            pipe.rpush(keys.slots, *[1] * self.max_parallel)
+            for key in (keys.pending, keys.slots):
+                pipe.expire(key, WORKFLOW_TTL)
+            pipe.execute()
+
+        app.backend.store_result(workflow_id, None, states.STARTED)
+        roots = [node for node, parents in self.parents.items() if not parents]
+        _enqueue(keys, [(node, None) for node in roots])
+        _pump(keys, self.spec())
+        return AsyncResult(workflow_id, app=app)
+
+
+class Keys:
+    """
+    Redis keys of the state of a workflow.
+    """
+
+    def __init__(self, workflow_id: str):
+        self.id = workflow_id
+        prefix = f"workflow:{workflow_id}:"
+        self.spec = prefix + "spec"
+        # Unfinished nodes, the workflow is done at 0
+        self.left = prefix + "left"
+        # Parents each node still waits for
+        self.pending = prefix + "pending"
+        # Items each `foreach` node still waits for
+        self.remaining = prefix + "remaining"
+        self.results = prefix + "results"
+        self.ready = prefix + "ready"
+        # One token per task that may be in flight
+        self.slots = prefix + "slots"
+        self.failed = prefix + "failed"
+        # Task id of each sent unit, see `unit`
+        self.tasks = prefix + "tasks"
+        # Items of each `foreach` node, once its parent is done
+        self.sizes = prefix + "sizes"
+
+    def items(self, node: str) -> str:
+        return f"workflow:{self.id}:items:{node}"
+
+
+def unit(node: str, index: Optional[int] = None) -> str:
+    """
+    Name of a task of a workflow, the node or, for a `foreach` node, the
+    node and the index of the item, e.g. `clip:3`.
+    """
+    return node if index is None else f"{node}:{index}"
+
+
+def _load(keys: Keys) -> Dict[str, Any]:
+    return json.loads(app.backend.client.get(keys.spec))
+
+
+def _enqueue(keys: Keys, units: List[tuple]):
+    if units:
+        client = app.backend.client
+        client.rpush(keys.ready, *[json.dumps(unit) for unit in units])
+        client.expire(keys.ready, WORKFLOW_TTL)
+
+
+def _pump(keys: Keys, spec: Dict[str, Any]):
+    """
+    Send ready tasks while there are free slots. A slot is given back before
+    looking at the ready list again, so a unit enqueued concurrently is
+    either seen here or finds that slot in its own `_pump`.
+    """
+    client = app.backend.client
+    while not client.exists(keys.failed):
+        if client.lpop(keys.slots) is None:
+            return
+        unit = client.lpop(keys.ready)
+        if unit is None:
+            client.rpush(keys.slots, 1)
+            if client.llen(keys.ready) == 0:
+                return
+            continue
+        node, index = json.loads(unit)
+        _send(keys, spec, node, index)
+
+
+def _send(keys: Keys, spec: Dict[str, Any], node: str, index: Optional[int]):
+    parents = spec["parents"][node]
+    results = app.backend.client.hmget(keys.results, parents) if parents else []
+    args = [json.loads(result) for result in results]
+    if index is not None:
+        i = parents.index(spec["foreach"][node])
+        args[i] = args[i][index]
+
+    sig: Signature = signature(spec["nodes"][node], app=app).clone(args=tuple(args))
+    done = node_done.s(keys.id, node, index)
+    # The callback failing fails the workflow too, or it would never finish
+    done.link_error(node_failed.s(keys.id, node, index))
+    sig.link(done)
+    sig.link_error(node_failed.s(keys.id, node, index))
+    # Recorded before sending, so the task can't be done before it is known
+    client = app.backend.client
+    client.hset(keys.tasks, unit(node, index), sig.freeze().id)
+    client.expire(keys.tasks, WORKFLOW_TTL)
+    sig.apply_async()
+
+
+def _complete(keys: Keys, spec: Dict[str, Any], node: str, result: Any):
+    client = app.backend.client
+    client.hset(keys.results, node, json.dumps(result))
+    client.expire(keys.results, WORKFLOW_TTL)
+
+    units = []
+    for child in spec["children"][node]:
+        if client.hincrby(keys.pending, child, -1) != 0:
+            continue
+        parent = spec["foreach"].get(child)
+        if parent is None:
+            units.append((child, None))
+            continue
+        items = json.loads(client.hget(keys.results, parent))
+        client.hset(keys.sizes, child, len(items))
+        client.expire(keys.sizes, WORKFLOW_TTL)
+        if not items:
+            _complete(keys, spec, child, [])
+            continue
+        client.hset(keys.remaining, child, len(items))
+        client.expire(keys.remaining, WORKFLOW_TTL)
+        units.extend((child, i) for i in range(len(items)))
+    _enqueue(keys, units)
+
+    if client.decr(keys.left) == 0:
+        sinks = [name for name, children in spec["children"].items() if not children]
+        results = client.hmget(keys.results, sinks)
+        app.backend.mark_as_done(
+            keys.id, {name: json.loads(r) for name, r in zip(sinks, results)}
+        )
+
+
+@app.task(ignore_result=True)
+def node_done(result: Any, workflow_id: str, node: str, index: Optional[int]):
+    """
+    Link callback of every task of a workflow, records its result and sends
+    what it unblocks.
+    """
+    keys = Keys(workflow_id)
+    spec = _load(keys)
+    client = app.backend.client
+
+    if index is None:
+        _complete(keys, spec, node, result)
+    else:
+        items_key = keys.items(node)
+        client.hset(items_key, index, json.dumps(result))
+        client.expire(items_key, WORKFLOW_TTL)
+        if client.hincrby(keys.remaining, node, -1) == 0:
+            items = client.hgetall(items_key)
+            results = [json.loads(items[str(i).encode()]) for i in range(len(items))]
+            _complete(keys, spec, node, results)
+
+    client.rpush(keys.slots, 1)
+    _pump(keys, spec)
+
+
+@app.task(ignore_result=True)
+def node_failed(request, exc, traceback, workflow_id: str, node: str, index):
+    """
+    Error callback of every task of a workflow and of its `node_done`, fails
+    the workflow with the exception, nothing else is sent.
+    """
+    print(f"node_failed() - workflow[{workflow_id}] node[{node}] index[{index}]")
+    keys = Keys(workflow_id)
+    client = app.backend.client
+    client.set(keys.failed, node, ex=WORKFLOW_TTL)
+    client.rpush(keys.slots, 1)
+    app.backend.mark_as_failure(workflow_id, exc)
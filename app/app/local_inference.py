@@ -0,0 +1,100 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+import asyncio
+import multiprocessing
+import os
+
+from .celery_app.ml_tasks import MODEL_CLASS, WARMUP_MESSAGES
+
+# `local` scores in a process pool owned by the web server, `celery` always offloads
+ML_SERVING_MODE = os.getenv("ML_SERVING_MODE", "celery")
+ML_LOCAL_WORKERS = int(os.getenv("ML_LOCAL_WORKERS", "2"))
+# Requests in flight in the pool before new ones are offloaded to `ml_service`
+ML_LOCAL_MAX_PENDING = int(os.getenv("ML_LOCAL_MAX_PENDING", str(2 * ML_LOCAL_WORKERS)))
+
+# Model of the current pool process, set by `_init_model`
+_model = None
+
+
+def _init_model(model_class: str):
+    global _model
+    from ml import model
+
+    _model = getattr(model, model_class)()
+    _model.predict_many(WARMUP_MESSAGES)
+
+
+def _predict_many(msgs: List[str]) -> List[Dict[str, Any]]:
+    return _model.predict_many(msgs)
+
+
+class LocalModelPool:
+    """
+    Process pool with one `SpamModel` per process, for answering predictions
+    inside the web server without a broker round trip.
+    """
+
+    def __init__(
+        self,
+        workers: int = ML_LOCAL_WORKERS,
+        max_pending: int = ML_LOCAL_MAX_PENDING,
+        model_class: str = MODEL_CLASS,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.model_class = model_class
+        self.pending = 0
+        self.stats = {"local": 0, "offloaded": 0}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def start(self):
+        # `spawn` avoids forking the event loop and its threads
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_model,
+            initargs=(self.model_class,),
+        )
+        # Start every process now, so the first requests do not pay for loading
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *[
+                loop.run_in_executor(self._executor, _predict_many, WARMUP_MESSAGES)
+                for _ in range(self.workers)
+            ]
+        )
+        print(f"LocalModelPool.start() - workers[{self.workers}] ready")
+
+    async def predict(self, msg: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns None when the pool is saturated, the caller should offload.
+        """
+        results = await self.predict_many([msg])
+        return results[0] if results is not None else None
+
+    async def predict_many(self, msgs: List[str]) -> Optional[List[Dict[str, Any]]]:
+        if self._executor is None or self.pending >= self.max_pending:
+            self.stats["offloaded"] += 1
+            return None
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self._executor, _predict_many, msgs)
+        finally:
+            self.pending -= 1
+        self.stats["local"] += 1
+        return results
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
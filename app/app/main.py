@@ -1,21 +1,84 @@
-from fastapi import FastAPI, Depends, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from enum import Enum
 from pydantic import BaseModel
-from typing import Any, Union, Optional
+from typing import Any, Union, Optional, List
 from sqlalchemy.orm import Session
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import partial
+import collections
+import json
+import uuid
 
-from celery.result import AsyncResult
+from celery import Task
+from celery.result import AsyncResult, GroupResult
 
 from .celery_app import ml_tasks, email_tasks, tasks
+from .celery_app.app import app as celery, setup_pools, close_pools
 
 from pprint import pprint
 from . import schemas
-
-
-app = FastAPI()
+from .cache import PredictionCache
+from .local_inference import LocalModelPool, ML_SERVING_MODE
+from .results import ResultWaiter
+from .publish import AsyncPublisher, PublishError
+from .monitor import ClusterMonitor, MONITOR_ENABLED
+from .admission import AdmissionController, Overloaded
+from .singleflight import SingleFlight
+
+prediction_cache = PredictionCache()
+result_waiter = ResultWaiter(celery)
+publisher = AsyncPublisher()
+admission = AdmissionController(celery)
+# Identical `/detect-spam` requests in flight share one prediction
+spam_flights = SingleFlight()
+cluster_monitor: Optional[ClusterMonitor] = (
+    ClusterMonitor(celery) if MONITOR_ENABLED else None
+)
+local_model_pool: Optional[LocalModelPool] = (
+    LocalModelPool() if ML_SERVING_MODE == "local" else None
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, setup_pools)
+    except Exception as e:
+        # Pools connect lazily on first use then
+        print(f"lifespan() - broker/backend not reachable[{e}]")
+    await result_waiter.start()
+    await publisher.start()
+    await admission.start()
+    if local_model_pool is not None:
+        await local_model_pool.start()
+    if cluster_monitor is not None:
+        cluster_monitor.start()
+    yield
+    if cluster_monitor is not None:
+        await loop.run_in_executor(None, cluster_monitor.stop)
+    if local_model_pool is not None:
+        local_model_pool.shutdown()
+    await prediction_cache.close()
+    await result_waiter.stop()
+    await publisher.stop()
+    await admission.stop()
+    await loop.run_in_executor(None, close_pools)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, e: Overloaded):
+    return JSONResponse(
+        status_code=e.status_code,
+        content={"detail": str(e)},
+        headers={"Retry-After": str(e.retry_after)},
+    )
 
 
 html_content = """
@@ -82,29 +145,18 @@ html_content = """
     }
 
     function getStatus(taskID) {
-    fetch(`/tasks/${taskID}`, {
-        method: 'GET',
-        headers: {
-        'Content-Type': 'application/json'
-        },
-    })
-    .then(response => response.json())
-    .then(task => {
+    // Every state of the task is pushed as it is stored, until it is ready
+    const source = new EventSource(`/tasks/stream?task_ids=${taskID}`);
+    source.onmessage = function(event) {
+        const task = JSON.parse(event.data);
         console.log(task)
-        if (!task) {
-            setTimeout(function() {
-                getStatus(taskID);
-            }, 1000);
-            return false
-        }
         const html = `
         <tr>
             <td>${task.task_id}</td>
             <td>${task.status}</td>
-            <td>${task.result}</td>
+            <td>${JSON.stringify(task.result)}</td>
             <td>${task.date_done}</td>
             <td>${task.name}</td>
-            <td>${task.status}</td>
             <td>${task.args}</td>
             <td>${task.kwargs}</td>
             <td>${task.worker}</td>
@@ -115,19 +167,45 @@ html_content = """
         newRow.innerHTML = html;
 
         const taskStatus = task.status;
-        if ( taskStatus === 'SUCCESS' || taskStatus === 'FAILURE') return true;
-
-        setTimeout(function() {
-            getStatus(taskID);
-        }, 1000);
-    })
-    .catch(err => console.log(err));
+        // Or the browser reconnects when the stream ends
+        if (['SUCCESS', 'FAILURE', 'REVOKED'].includes(taskStatus)) source.close();
+    };
+    // Sent once every task is ready, whatever state they ended in
+    source.addEventListener('end', () => source.close());
     }
     </script>
 </html>
 """
 
 
+async def wait_result(task: AsyncResult, timeout: float) -> Any:
+    try:
+        return await result_waiter.wait(task.id, timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=504, detail=f"Task[{task.id}] not done in {timeout}s"
+        )
+
+
+async def submit(
+    task: Task, *args, result_timeout: Optional[float] = None, **kwargs
+) -> Any:
+    """
+    Enqueue `task` if its queue admits more work, else raise `Overloaded`.
+    Returns its result, waited for up to `result_timeout` seconds, after
+    which the task expires, or its `AsyncResult` without a timeout.
+    """
+    async with admission.admit(task):
+        if result_timeout is None:
+            return await publisher.delay(task, *args, **kwargs)
+
+        # Past the deadline no one reads the result, workers drop the task unrun
+        result: AsyncResult = await publisher.apply_async(
+            task, args, kwargs, expires=result_timeout
+        )
+        return await wait_result(result, result_timeout)
+
+
 @app.get("/", response_class=HTMLResponse)
 async def read_index():
     return HTMLResponse(content=html_content, status_code=200)
@@ -138,7 +216,7 @@ async def test_celery(msg: str):
     """
     Test Celery worker.
     """
-    task: AsyncResult = tasks.echo.delay(msg)
+    task: AsyncResult = await submit(tasks.echo, msg)
 
     # Main loop
     # loop = asyncio.get_running_loop()
@@ -154,7 +232,7 @@ async def do_long_running_task(secs: float):
     """
     Test Celery worker.
     """
-    task: AsyncResult = tasks.wait.delay(secs)
+    task: AsyncResult = await submit(tasks.wait, secs)
     print(f"Start long running task[{task.id}] [{secs}]s")
     # Main loop
     # loop = asyncio.get_running_loop()
@@ -165,23 +243,74 @@ async def do_long_running_task(secs: float):
     return {"msg": f"Start long running task[{task.id}] [{secs}]s"}
 
 
+def check_model(model: str):
+    # Unknown models would only fail on the ml worker
+    if model not in ml_tasks.model_host.catalog:
+        raise HTTPException(status_code=404, detail=f"Model[{model}] not found")
+
+
 @app.get("/detect-spam", response_model=None)
-async def detect_spam(msg: str):
-    # result = ml_tasks.detect_spam(msg=msg)
-    task: AsyncResult = ml_tasks.detect_spam.delay(msg)
+async def detect_spam(msg: str, model: str = ml_tasks.DEFAULT_MODEL):
+    check_model(model)
+    result = await prediction_cache.get(msg, model)
+    if result is not None:
+        return result
+
+    key = prediction_cache.key(msg, model)
+    return await spam_flights.do(key, partial(predict_spam, msg, model))
+
+
+async def predict_spam(msg: str, model: str) -> Any:
+    result = None
+    # The local pool only hosts the default model
+    if local_model_pool is not None and model == ml_tasks.DEFAULT_MODEL:
+        result = await local_model_pool.predict(msg)
+
+    # Offload to `ml_service` when serving through Celery or the local pool is saturated
+    if result is None:
+        # result = ml_tasks.detect_spam(msg=msg)
+        if ml_tasks.ML_BATCH_ENABLED:
+            task = ml_tasks.detect_spam_batch
+        else:
+            task = ml_tasks.detect_spam
+        result = await submit(task, msg, model=model, result_timeout=10)
+
+    await prediction_cache.set(msg, result, model)
+    return result
 
-    # Main loop
-    loop = asyncio.get_running_loop()
-    with ThreadPoolExecutor() as pool:
-        result = await loop.run_in_executor(pool, task.get, 10)
-        print(f"custom thread pool result[{result}]")
 
+@app.post("/detect-spam/batch", response_model=List[schemas.SpamPrediction])
+async def detect_spam_batch(batch: schemas.SpamBatchIn):
+    check_model(batch.model)
+    if local_model_pool is not None and batch.model == ml_tasks.DEFAULT_MODEL:
+        result = await local_model_pool.predict_many(batch.msgs)
+        if result is not None:
+            return result
+
+    result = await submit(
+        ml_tasks.detect_spam_many, batch.msgs, model=batch.model, result_timeout=10
+    )
     return result
 
 
+@app.post("/detect-spam/csv", status_code=201)
+async def score_csv(job: schemas.ScoreCsvIn):
+    """
+    Start a bulk scoring job over a CSV file of the workers' data directory,
+    its `PROGRESS` state reports `current`/`total` rows.
+    """
+    check_model(job.model)
+    try:
+        tasks.data_path(job.input_file), tasks.data_path(job.output_file)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    task: AsyncResult = await submit(tasks.score_csv, **job.model_dump())
+    return {"task_id": task.id}
+
+
 @app.get("/send-email", response_model=None)
 async def send_email(email_to: str = "user1@rms.intranet"):
-    task: AsyncResult = email_tasks.send_email.delay(email_to)
+    task: AsyncResult = await submit(email_tasks.send_email, email_to)
 
     # Main loop
     # loop = asyncio.get_running_loop()
@@ -192,51 +321,165 @@ async def send_email(email_to: str = "user1@rms.intranet"):
     return {"msg": f"Message sent to: {email_to}"}
 
 
+@app.get("/metrics", response_model=None)
+async def read_metrics():
+    return {
+        "prediction_cache": prediction_cache.info(),
+        "local_model_pool": local_model_pool.info() if local_model_pool else None,
+        "result_waiter": result_waiter.info(),
+        "publisher": publisher.info(),
+        "admission": admission.info(),
+        "spam_flights": spam_flights.info(),
+        "cluster_monitor": cluster_monitor.info() if cluster_monitor else None,
+    }
+
+
+@app.get("/models", response_model=None)
+async def read_models():
+    """
+    Models hosted by each ml worker, with load time and estimated resident size.
+    """
+    loop = asyncio.get_running_loop()
+    replies = await loop.run_in_executor(
+        None, partial(celery.control.broadcast, "model_stats", reply=True, timeout=1)
+    )
+    return {worker: stats for reply in replies for worker, stats in reply.items()}
+
+
 @app.get("/tasks", response_model=None)
-async def read_tasks():
-    i = email_tasks.app.control.inspect()
+async def read_tasks(
+    state: Optional[str] = None,
+    name: Optional[str] = None,
+    worker: Optional[str] = None,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1, le=1000),
+):
+    """
+    Workers and tasks of the cluster as last seen by the monitor, filtered
+    by task `state`, `name` and `worker`, most recent first.
+    """
+    if cluster_monitor is None:
+        raise HTTPException(status_code=503, detail="Cluster monitor disabled")
     return {
-        "reserved": i.reserved(),
-        "active": i.active(),
-        "scheduled": i.scheduled(),
-        "registered": i.registered(),
+        "workers": cluster_monitor.workers(),
+        **cluster_monitor.tasks(state, name, worker, offset, limit),
     }
 
 
-# @app.post("/tasks", status_code=201)
-# def create_task(task: schemas.TaskIn):
-#     task_result: AsyncResult = None
+# Seconds of `tasks.progress` for each task type of the dashboard
+TASK_TYPE_SECS = {
+    schemas.TaskType.short: 5,
+    schemas.TaskType.medium: 15,
+    schemas.TaskType.long: 30,
+}
 
-#     if task.type == schemas.TaskType.short:
-#         task_result = create_short_task.delay()
-#     if task.type == schemas.TaskType.medium:
-#         task_result = create_medium_task.delay()
-#     if task.type == schemas.TaskType.long:
-#         task_result = create_long_task.delay()
 
-#     task_id = task_result.id
-#     pprint(task_id)
+@app.post("/tasks", status_code=201)
+async def create_task(task: schemas.TaskIn):
+    secs = TASK_TYPE_SECS[task.type or schemas.TaskType.short]
+    task_result: AsyncResult = await submit(tasks.progress, secs)
+    return {"task_id": task_result.id}
 
-#     return {"task_id": task_id}
 
+BULK_TASKS = {
+    schemas.BulkTaskType.echo: tasks.echo,
+    schemas.BulkTaskType.wait: tasks.wait,
+    schemas.BulkTaskType.send_email: email_tasks.send_email,
+}
 
-# @app.get("/tasks/{task_id}", response_model=Optional[schemas.Task])
-# def read_task(task_id: str):
 
-#     result = AsyncResult(task_id, app=celery_app)
-#     pprint(celery_app.conf.database_table_names)
+@app.post("/tasks/bulk", status_code=201)
+async def create_tasks(body: schemas.BulkTaskIn):
+    """
+    Enqueue many tasks in one request, published in batches over pooled
+    producers. With `save_group` they also make a saved group.
+    """
+    group_id = str(uuid.uuid4()) if body.save_group else None
+    options = {"group_id": group_id} if group_id else {}
+    calls = [
+        (BULK_TASKS[spec.type], tuple(spec.args), spec.kwargs, options)
+        for spec in body.tasks
+    ]
+
+    async with AsyncExitStack() as stack:
+        counts = collections.Counter(task for task, *_ in calls)
+        for task, count in counts.items():
+            await stack.enter_async_context(admission.admit(task, count))
+        try:
+            results = await publisher.apply_many(calls)
+        except PublishError as e:
+            task_ids = [result.id for result in e.results]
+            print(f"create_tasks() - error[{e}] published task_ids[{task_ids}]")
+            # The caller can still track or revoke what went out
+            raise HTTPException(
+                status_code=503, detail={"error": str(e), "task_ids": task_ids}
+            )
+
+    if group_id:
+        # Building the group subscribes its results on the backend, blocking too
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: GroupResult(group_id, results, app=celery).save()
+        )
+    return {"task_ids": [result.id for result in results], "group_id": group_id}
+
+
+@app.post("/tasks/status", response_model=List[schemas.Task])
+async def read_task_statuses(body: schemas.TaskStatusIn):
+    """
+    Status of many tasks in one backend round trip, for clients polling several tasks.
+    """
+    return await result_waiter.read_many(body.task_ids)
 
-#     task = schemas.Task(
-#         task_id=result.task_id,
-#         status=result.status,
-#         date_done=result.date_done,
-#         name=result.name,
-#         args=result.args,
-#         kwargs=result.kwargs,
-#         worker=result.worker,
-#         retries=result.retries,
-#         queue=result.queue,
-#     )
-#     pprint(task)
 
-#     return task
+@app.get("/tasks/stream")
+async def stream_tasks(
+    task_ids: List[str] = Query(default=[]), group_id: Optional[str] = None
+):
+    """
+    Server-sent events of the states of `task_ids` and of the tasks of the
+    saved group `group_id`, one `schemas.Task` per change until all are ready,
+    then an `end` event.
+    """
+    if group_id is not None:
+        children = await result_waiter.group_children(group_id)
+        if children is None:
+            raise HTTPException(status_code=404, detail=f"Group[{group_id}] not found")
+        task_ids = task_ids + children
+    if not task_ids:
+        raise HTTPException(status_code=422, detail="No task_ids or group_id")
+
+    async def events():
+        async for task in result_waiter.watch(task_ids, heartbeat=15):
+            if task is None:
+                # Comment line, keeps proxies from closing an idle stream
+                yield ": heartbeat\n\n"
+            else:
+                yield f"data: {json.dumps(task, default=str)}\n\n"
+        # Tells `EventSource` not to reconnect
+        yield "event: end\ndata: {}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/tasks/{task_id}", response_model=Optional[schemas.Task])
+async def read_task(task_id: str):
+    [task] = await result_waiter.read_many([task_id])
+    return task
+
+
+@app.get("/workflows/{workflow_id}", response_model=schemas.Workflow)
+async def read_workflow(workflow_id: str):
+    """
+    State of a workflow, e.g. started by `tasks.pipeline`, and of every task
+    of it, read in one go instead of following its results one by one.
+    """
+    workflow = await result_waiter.read_workflow(workflow_id)
+    if workflow is None:
+        raise HTTPException(
+            status_code=404, detail=f"Workflow[{workflow_id}] not found"
+        )
+    return workflow
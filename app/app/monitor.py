@@ -0,0 +1,187 @@
+from typing import Any, Dict, List, Optional
+import os
+import threading
+import time
+
+from celery import Celery, states
+
+MONITOR_ENABLED = os.getenv("MONITOR_ENABLED", "1") == "1"
+MONITOR_MAX_TASKS = int(os.getenv("MONITOR_MAX_TASKS", "10000"))
+MONITOR_RECONCILE_INTERVAL = float(os.getenv("MONITOR_RECONCILE_INTERVAL", "30"))
+
+
+class ClusterMonitor:
+    """
+    In-memory picture of the workers and tasks of a Celery cluster.
+
+    A thread follows the event stream into a `celery.events.State`, another
+    one runs the `inspect` broadcasts every `reconcile_interval` seconds to
+    add what the events missed (tasks started before the monitor, lost
+    events) and the tasks registered on each worker. Reads never leave
+    the process.
+    """
+
+    def __init__(
+        self,
+        app: Celery,
+        max_tasks: int = MONITOR_MAX_TASKS,
+        reconcile_interval: float = MONITOR_RECONCILE_INTERVAL,
+    ):
+        self.app = app
+        self.reconcile_interval = reconcile_interval
+        self.state = app.events.State(max_tasks_in_memory=max_tasks)
+        self.registered: Dict[str, List[str]] = {}
+        self.stats = {"events": 0, "reconciles": 0, "errors": 0}
+        self.reconciled_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._receiver = None
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=target, name=name, daemon=True)
+            for target, name in [
+                (self._capture, "monitor-events"),
+                (self._reconcile_loop, "monitor-reconcile"),
+            ]
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._receiver is not None:
+            self._receiver.should_stop = True
+        for thread in self._threads:
+            # Daemon threads, a capture stuck connecting does not hold up shutdown
+            thread.join(timeout=1)
+        self._threads = []
+
+    def _capture(self):
+        backoff = 1
+        while not self._stopping.is_set():
+            try:
+                with self.app.connection_for_read() as conn:
+                    self._receiver = self.app.events.Receiver(
+                        conn, handlers={"*": self._on_event}
+                    )
+                    # Workers answer the wakeup with a heartbeat, so they show up at once
+                    self._receiver.capture(limit=None, timeout=None, wakeup=True)
+                backoff = 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"ClusterMonitor._capture() - error[{e}]")
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _on_event(self, event: Dict[str, Any]):
+        with self._lock:
+            self.state.event(event)
+        self.stats["events"] += 1
+
+    def _reconcile_loop(self):
+        while not self._stopping.is_set():
+            try:
+                self.reconcile()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"ClusterMonitor.reconcile() - error[{e}]")
+            self._stopping.wait(self.reconcile_interval)
+
+    def reconcile(self):
+        inspect = self.app.control.inspect(timeout=1)
+        self.merge(
+            active=inspect.active() or {},
+            reserved=inspect.reserved() or {},
+            scheduled=inspect.scheduled() or {},
+            registered=inspect.registered() or {},
+        )
+
+    def merge(
+        self,
+        active: Dict[str, List[Dict]],
+        reserved: Dict[str, List[Dict]],
+        scheduled: Dict[str, List[Dict]],
+        registered: Dict[str, List[str]],
+    ):
+        """
+        Merge the replies of `inspect` into the state, tasks already known
+        from events keep what the events say.
+        """
+        with self._lock:
+            for replies, state in [
+                (active, states.STARTED),
+                (reserved, states.RECEIVED),
+                (scheduled, states.RECEIVED),
+            ]:
+                for hostname, requests in replies.items():
+                    worker, _ = self.state.get_or_create_worker(hostname)
+                    for request in requests:
+                        # Scheduled entries wrap the request with its `eta`
+                        request = request.get("request", request)
+                        task, created = self.state.get_or_create_task(request["id"])
+                        if not created and task.state != states.PENDING:
+                            continue
+                        task.name = request.get("name")
+                        task.args = request.get("args")
+                        task.kwargs = request.get("kwargs")
+                        task.worker = worker
+                        task.state = state
+                        task.timestamp = request.get("time_start") or time.time()
+            self.registered = registered
+            self.reconciled_at = time.time()
+        self.stats["reconciles"] += 1
+
+    def workers(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                hostname: {
+                    "alive": worker.alive,
+                    "active": worker.active,
+                    "processed": worker.processed,
+                    "heartbeat": worker.heartbeats[-1] if worker.heartbeats else None,
+                    "registered": self.registered.get(hostname),
+                }
+                for hostname, worker in self.state.workers.items()
+            }
+
+    def tasks(
+        self,
+        state: Optional[str] = None,
+        name: Optional[str] = None,
+        worker: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 100,
+    ) -> Dict[str, Any]:
+        """
+        Tasks matching every given filter, most recent first, `limit` of
+        them from `offset` on.
+        """
+        with self._lock:
+            tasks = list(self.state.tasks.values())
+
+        matches = [
+            task
+            for task in tasks
+            if (state is None or task.state == state)
+            and (name is None or task.name == name)
+            and (worker is None or (task.worker and task.worker.hostname == worker))
+        ]
+        matches.sort(key=lambda task: task.timestamp or 0, reverse=True)
+        return {
+            "total": len(matches),
+            "tasks": [
+                {**task.as_dict(), "worker": task.worker and task.worker.hostname}
+                for task in matches[offset : offset + limit]
+            ],
+        }
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "workers": len(self.state.workers),
+            "tasks": len(self.state.tasks),
+            "reconciled_at": self.reconciled_at,
+        }
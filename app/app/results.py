@@ -0,0 +1,334 @@
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+import asyncio
+import contextlib
+import json
+
+from celery import Celery, states
+import redis.asyncio as redis
+
+from .celery_app import workflow
+
+
+class _Pending:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        # Resolved once Redis confirms the subscription to the task channel
+        self.subscribed: asyncio.Future = loop.create_future()
+        self.futures: Set[asyncio.Future] = set()
+        # Streams of `watch`, fed every state the task goes through
+        self.queues: Set[asyncio.Queue] = set()
+
+    def __bool__(self):
+        return bool(self.futures or self.queues)
+
+
+class ResultWaiter:
+    """
+    Waits for Celery results from coroutines, without a thread per waiter.
+
+    The Redis result backend publishes every stored result on the channel
+    named after its key. One pub/sub connection subscribes to the channels
+    of the awaited tasks and resolves their futures, so any number of
+    requests can wait on results, or stream their progress, concurrently.
+    """
+
+    def __init__(self, app: Celery, redis_url: Optional[str] = None):
+        self.app = app
+        self.redis_url = redis_url or app.conf.result_backend
+        self.prefix = app.backend.task_keyprefix.decode()
+        self.stats = {"resolved": 0, "timeouts": 0, "reads": 0}
+        self._pending: Dict[str, _Pending] = {}
+        self._redis: Optional[redis.Redis] = None
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def start(self):
+        self._closing = False
+        self._redis = redis.Redis.from_url(self.redis_url)
+        self._pubsub = self._redis.pubsub()
+        # Open the connection, so the reader has something to listen on
+        await self._pubsub.subscribe(f"{self.prefix}result-waiter")
+        self._reader = asyncio.create_task(self._read())
+
+    async def stop(self):
+        # The flag stops the reader even if a pending read swallows the cancellation
+        self._closing = True
+        if self._reader is not None:
+            self._reader.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reader
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._redis is not None:
+            await self._redis.aclose()
+
+    async def wait(self, task_id: str, timeout: Optional[float] = None) -> Any:
+        """
+        Return the result of `task_id`, or raise the exception it failed with.
+        Raises `asyncio.TimeoutError` after `timeout` seconds.
+        """
+        channel = self.prefix + task_id
+        future = asyncio.get_running_loop().create_future()
+        pending = await self._acquire(task_id)
+        pending.futures.add(future)
+
+        try:
+            return await asyncio.wait_for(
+                self._wait(task_id, channel, pending, future), timeout
+            )
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+        finally:
+            pending.futures.discard(future)
+            await self._release(task_id, pending)
+
+    async def watch(
+        self, task_ids: List[str], heartbeat: Optional[float] = None
+    ) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yield the state of each task in `task_ids`, as `read_many` does, now
+        and then on every change, until all of them are ready. Yields `None`
+        after `heartbeat` seconds without a change.
+        """
+        queue = asyncio.Queue()
+        pendings = {}
+        try:
+            for task_id in task_ids:
+                pendings[task_id] = pending = await self._acquire(task_id)
+                pending.queues.add(queue)
+            for pending in pendings.values():
+                await asyncio.shield(pending.subscribed)
+            # States stored before the subscriptions
+            for task in await self.read_many(list(pendings)):
+                queue.put_nowait(task)
+
+            last, ready = {}, set()
+            while len(ready) < len(pendings):
+                try:
+                    task = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                # The snapshot may arrive after newer states, or repeat them
+                if task["task_id"] in ready or last.get(task["task_id"]) == task:
+                    continue
+                last[task["task_id"]] = task
+                if task["status"] in states.READY_STATES:
+                    ready.add(task["task_id"])
+                yield task
+        finally:
+            for task_id, pending in pendings.items():
+                pending.queues.discard(queue)
+                await self._release(task_id, pending)
+
+    async def group_children(self, group_id: str) -> Optional[List[str]]:
+        """
+        Ids of the tasks of a group saved with `GroupResult.save()`, `None`
+        if there is no such group.
+        """
+        payload = await self._redis.get(
+            self.app.backend.group_keyprefix.decode() + group_id
+        )
+        if payload is None:
+            return None
+        # `GroupResult.as_tuple()`, read as is, building the results would
+        # have the synchronous backend subscribe to them
+        _, results = self.app.backend.decode(payload)["result"]
+        children = []
+        while results:
+            (task_id, _), nested = results.pop(0)
+            if nested:
+                results.extend(nested)
+            else:
+                children.append(task_id)
+        return children
+
+    async def read_workflow(self, workflow_id: str) -> Optional[Dict[str, Any]]:
+        """
+        State, progress and result of a `Workflow` and of each of its nodes,
+        with the state of each of their tasks, in two round trips whatever
+        the size of the workflow. `None` if there is no such workflow.
+        """
+        keys = workflow.Keys(workflow_id)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.get(keys.spec)
+            pipe.hgetall(keys.tasks)
+            pipe.hgetall(keys.sizes)
+            spec, sent, sizes = await pipe.execute()
+        if spec is None:
+            return None
+        spec = json.loads(spec)
+        sent = {name.decode(): task_id.decode() for name, task_id in sent.items()}
+        sizes = {node.decode(): int(size) for node, size in sizes.items()}
+
+        main, *tasks = await self.read_many([workflow_id, *sent.values()])
+        tasks = dict(zip(sent, tasks))
+
+        nodes = []
+        for node in spec["nodes"]:
+            if node in spec["foreach"]:
+                units = [workflow.unit(node, i) for i in range(sizes.get(node, 0))]
+            else:
+                units = [node]
+            node_tasks = [tasks[unit] for unit in units if unit in tasks]
+            done = [task for task in node_tasks if task["status"] == states.SUCCESS]
+            failed = [
+                task for task in node_tasks if task["status"] in states.PROPAGATE_STATES
+            ]
+            # A `foreach` node is only sized once its parent is done
+            if node in spec["foreach"] and node not in sizes:
+                progress = 0.0
+            else:
+                progress = len(done) / len(units) if units else 1.0
+
+            if failed:
+                status = failed[0]["status"]
+            elif progress == 1.0:
+                status = states.SUCCESS
+            elif node_tasks:
+                status = states.STARTED
+            else:
+                status = states.PENDING
+
+            result = None
+            if status == states.SUCCESS:
+                results = [task["result"] for task in done]
+                result = results if node in spec["foreach"] else results[0]
+            nodes.append(
+                {
+                    "node": node,
+                    "status": status,
+                    "progress": progress,
+                    "result": result,
+                    "parents": spec["parents"][node],
+                    "tasks": node_tasks,
+                }
+            )
+
+        return {
+            "workflow_id": workflow_id,
+            "status": main["status"],
+            "progress": sum(node["progress"] for node in nodes) / len(nodes),
+            "result": main["result"],
+            "date_done": main["date_done"],
+            "nodes": nodes,
+        }
+
+    async def _acquire(self, task_id: str) -> _Pending:
+        pending = self._pending.get(task_id)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = self._pending[task_id] = _Pending(loop)
+            await self._pubsub.subscribe(self.prefix + task_id)
+        return pending
+
+    async def _release(self, task_id: str, pending: _Pending):
+        if not pending and self._pending.get(task_id) is pending:
+            del self._pending[task_id]
+            await self._pubsub.unsubscribe(self.prefix + task_id)
+
+    async def _wait(self, task_id, channel, pending, future) -> Any:
+        await asyncio.shield(pending.subscribed)
+        # The result may have been stored before the subscription
+        payload = await self._redis.get(channel)
+        if payload is not None:
+            self._resolve(task_id, payload)
+        return await future
+
+    async def _read(self):
+        while not self._closing:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+                if message is not None:
+                    self._handle(message)
+            except redis.ConnectionError as e:
+                print(f"ResultWaiter._read() - error[{e}]")
+                await asyncio.sleep(1)
+            except Exception as e:
+                # Keep reading, or every later `wait` would run to its timeout
+                print(f"ResultWaiter._read() - error[{e!r}]")
+
+    def _handle(self, message: Dict[str, Any]):
+        channel = message["channel"].decode()
+        task_id = channel[len(self.prefix) :]
+        if message["type"] == "subscribe":
+            pending = self._pending.get(task_id)
+            if pending is not None and not pending.subscribed.done():
+                pending.subscribed.set_result(True)
+        elif message["type"] == "message":
+            self._resolve(task_id, message["data"])
+
+    async def read_many(self, task_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Current state of each task in `task_ids`, read with a single MGET.
+        Tasks without a stored result are `PENDING`, failures carry the
+        `repr` of their exception.
+        """
+        if not task_ids:
+            return []
+        payloads = await self._redis.mget([self.prefix + id for id in task_ids])
+
+        tasks = [
+            self._task(
+                task_id, self.app.backend.decode_result(payload) if payload else {}
+            )
+            for task_id, payload in zip(task_ids, payloads)
+        ]
+        self.stats["reads"] += 1
+        return tasks
+
+    @staticmethod
+    def _task(task_id: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+        result = meta.get("result")
+        if isinstance(result, BaseException):
+            result = repr(result)
+        return {
+            "task_id": task_id,
+            "status": meta.get("status", states.PENDING),
+            "result": result,
+            "date_done": meta.get("date_done"),
+            # Only stored with `result_extended`
+            "name": meta.get("name"),
+            "args": meta.get("args"),
+            "kwargs": meta.get("kwargs"),
+            "worker": meta.get("worker"),
+            "retries": meta.get("retries"),
+            "queue": meta.get("queue"),
+        }
+
+    def _resolve(self, task_id: str, payload: bytes):
+        pending = self._pending.get(task_id)
+        if pending is None:
+            return
+
+        try:
+            meta = self.app.backend.decode_result(payload)
+        except Exception as e:
+            # Its waiters would otherwise only see their timeout
+            for future in pending.futures:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        if pending.queues:
+            task = self._task(task_id, meta)
+            for queue in pending.queues:
+                queue.put_nowait(task)
+        if meta["status"] not in states.READY_STATES:
+            return
+
+        for future in pending.futures:
+            if future.done():
+                continue
+            result = meta["result"]
+            if meta["status"] == states.SUCCESS:
+                future.set_result(result)
+            elif isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_exception(Exception(f"Task {meta['status']}: {result}"))
+        self.stats["resolved"] += 1
+
+    def info(self) -> Dict[str, Any]:
+        return {**self.stats, "pending": len(self._pending)}
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from enum import Enum
 from typing import Union, Any, Optional, List, Dict
 from datetime import datetime
@@ -14,6 +14,51 @@ class TaskIn(BaseModel):
     type: Union[None, TaskType]
 
 
+class BulkTaskType(str, Enum):
+    echo = "echo"
+    wait = "wait"
+    send_email = "send_email"
+
+
+class TaskSpec(BaseModel):
+    type: BulkTaskType
+    args: List[Any] = []
+    kwargs: Dict[str, Any] = {}
+
+
+class BulkTaskIn(BaseModel):
+    # Admitted as a whole, so at most a queue's `ADMISSION_MAX_DEPTH`
+    tasks: List[TaskSpec] = Field(min_length=1, max_length=1000)
+    # Save the tasks as a group, to read or stream them by `group_id`
+    save_group: bool = False
+
+
+class TaskStatusIn(BaseModel):
+    task_ids: List[str]
+
+
+class SpamPrediction(BaseModel):
+    label: str
+    spam_probability: float
+    model_version: Optional[str] = None
+
+
+class ScoreCsvIn(BaseModel):
+    # Names of files in the workers' `CSV_DATA_DIR`
+    input_file: str
+    output_file: str
+    column: str = "Message"
+    chunk_size: int = Field(1000, gt=0, le=10000)
+    max_in_flight: int = Field(4, gt=0, le=64)
+    model: str = "spam"
+
+
+class SpamBatchIn(BaseModel):
+    # Scored in one call, which fails on no messages
+    msgs: List[str] = Field(min_length=1, max_length=1000)
+    model: str = "spam"
+
+
 # Ref: https://docs.celeryq.dev/en/latest/internals/reference/celery.backends.database.models.html
 # when `result_extended=True`, return [TaskExtended](https://docs.celeryq.dev/en/latest/internals/reference/celery.backends.database.models.html#celery.backends.database.models.TaskExtended`)
 # when `result_extended=False`, return [TaskExtended](https://docs.celeryq.dev/en/latest/internals/reference/celery.backends.database.models.html#celery.backends.database.models.Task`)
@@ -30,3 +75,21 @@ class Task(BaseModel):
     worker: Optional[str]
     retries: Optional[int]
     queue: Optional[str]
+
+
+class WorkflowNode(BaseModel):
+    node: str
+    status: str  # `PENDING`, `STARTED`, `SUCCESS` or the state it failed with
+    progress: float  # Share of its tasks done, a `foreach` node has one per item
+    result: Optional[Any]
+    parents: List[str]
+    tasks: List[Task]
+
+
+class Workflow(BaseModel):
+    workflow_id: str
+    status: str
+    progress: float
+    result: Optional[Any]
+    date_done: Optional[datetime]
+    nodes: List[WorkflowNode]
@@ -0,0 +1,41 @@
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first one runs, the
+    others wait for its result, or exception, instead of running again.
+
+    The call runs in its own task, so a caller going away, e.g. a client
+    disconnecting, does not cancel it for the callers sharing it.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda task: self._done(key, task))
+            self.stats["calls"] += 1
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieved, or asyncio logs it when every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def info(self) -> Dict[str, Any]:
+        requests = self.stats["calls"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "in_flight": len(self._calls),
+            "coalescing_ratio": self.stats["coalesced"] / requests if requests else 0.0,
+        }
@@ -199,61 +199,18 @@ dag_adjacency_list={
 }
 
 # t1 + t2 > t3 > t4 + (t51, t52, t53, t54, t55, t56) > t6
+
+Implemented by `app.celery_app.workflow.Workflow`, with `t5` in `foreach`.
 """
 
 
 def run_workflow():
     input_video = "foo.mp4"
     print(f"run_workflow() - process video[{input_video}]")
-    t1: Signature = tasks.convert_video.s(video_path=input_video).set(
-        task_id=str(uuid.uuid4())
-    )
-    t2: Signature = tasks.analyze_video.s(video_path=input_video).set(
-        task_id=str(uuid.uuid4())
-    )
-
-    g12: Signature = group(t1, t2)
-    g12_res: GroupResult = g12.apply_async()
-
-    # Blocking util t1, t2 all are completed
-    while not g12_res.ready():
-        res1 = AsyncResult(id=t1.id)
-        res2 = AsyncResult(id=t2.id)
-        print(f"result #t1, result[{res1.result}] status[{res1.status}]")
-        print(f"result #t2, result[{res2.result}] status[{res2.status}]")
-        print(
-            f"result #g12, completed_count#[{g12_res.completed_count()}] ready[{g12_res.ready()}]"
-        )
-
-        time.sleep(1)
-
-    print(f"result #g12, {g12_res.get()}")
-    output_video, frames = g12_res.get()
-
-    t4: Signature = tasks.mark_video.s(video_path=output_video).set(
-        task_id=str(uuid.uuid4())
-    )
-    t5: Signature = tasks.clip_videos.s(video_path=output_video, frames=frames).set(
-        task_id=str(uuid.uuid4())
-    )
-
-    g45: Signature = group(t4, t5)
-    g45_res: GroupResult = g45.apply_async()
-
-    # Blocking util t4, t5 all are completed
-    while not g45_res.ready():
-        res4 = AsyncResult(id=t4.id)
-        res5 = AsyncResult(id=t5.id)
-        print(f"result #t4, result[{res4.result}] status[{res4.status}]")
-        print(f"result #t5, result[{res5.result}] status[{res5.status}]")
-        print(
-            f"result #g45, result[{g45_res.completed_count()}] ready[{g45_res.ready()}]"
-        )
-
-        time.sleep(1)
+    # Each node is sent once its parents are done, see `app.celery_app.workflow.Workflow`
+    result: AsyncResult = tasks.video_workflow(input_video).apply_async()
 
-    print(f"result #g45, {g45_res.get()}")
-    mark_video, clipped_videos = g45_res.get()
+    print(f"run_workflow() - #[{result.id}] result: {result.get()}")
 
 
 def run_workflow_1():
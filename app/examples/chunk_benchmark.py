@@ -0,0 +1,42 @@
+"""
+Throughput of a tiny element-wise task, one message per element vs `chunked`.
+
+Each element sent on its own costs a broker message, an ack and a backend
+write, `chunked` pays those once per chunk. Needs the broker and a default
+worker from docker-compose, e.g. `python -m examples.chunk_benchmark`.
+"""
+
+import time
+
+from celery import group
+
+from app.celery_app import tasks
+
+
+def per_message(data):
+    return group(tasks.length.s(x) for x in data).delay()
+
+
+def measure(name, run, data):
+    start = time.perf_counter()
+    result = run(data).get(timeout=600)
+    elapsed = time.perf_counter() - start
+    assert result == [len(x) for x in data]
+    print(f"{name:>12} {len(data) / elapsed:12.0f} {elapsed:9.2f}")
+
+
+def main(n=10000, chunk_sizes=(1, 10, 100, 1000)):
+    data = [f"message {i}" for i in range(n)]
+
+    print(f"{'mode':>12} {'elements/s':>12} {'seconds':>9}")
+    measure("per message", per_message, data)
+    for chunk_size in chunk_sizes:
+        measure(
+            f"chunk {chunk_size}",
+            lambda data: tasks.chunked(tasks.length, data, chunk_size).delay(),
+            data,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Event-loop latency while enqueuing tasks from coroutines.
+
+Compares calling `.delay()` inside coroutines, as the endpoints used to,
+with `AsyncPublisher`. A ticker coroutine sleeps 1ms in a loop and records
+how late it wakes up, which is how long every other request would stall.
+
+Needs the broker from docker-compose, e.g. `python -m examples.publish_benchmark`.
+"""
+
+import asyncio
+import statistics
+import time
+
+from app.celery_app import tasks
+from app.publish import AsyncPublisher
+
+# No worker consumes it, so the benchmark tasks are never run, then purged
+QUEUE = "publish-benchmark"
+
+
+async def ticker(lags, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def enqueue_sync(n, concurrency):
+    async def client(count):
+        for _ in range(count):
+            tasks.log.apply_async(("benchmark",), queue=QUEUE)
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*[client(n // concurrency) for _ in range(concurrency)])
+
+
+async def enqueue_async(n, concurrency, publisher):
+    async def client(count):
+        for _ in range(count):
+            await publisher.apply_async(tasks.log, ("benchmark",), queue=QUEUE)
+
+    await asyncio.gather(*[client(n // concurrency) for _ in range(concurrency)])
+
+
+async def measure(name, enqueue):
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    start = time.perf_counter()
+    n = await enqueue()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+
+    lags.sort()
+    print(
+        f"{name:>6} {n / elapsed:9.0f} {1000 * statistics.median(lags):9.2f} "
+        f"{1000 * lags[int(len(lags) * 0.99)]:9.2f} {1000 * lags[-1]:9.2f}"
+    )
+
+
+async def main(n=5000, concurrency=100):
+    publisher = AsyncPublisher()
+    await publisher.start()
+
+    print(f"{'mode':>6} {'tasks/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+
+    async def sync():
+        await enqueue_sync(n, concurrency)
+        return n
+
+    async def pooled():
+        await enqueue_async(n, concurrency, publisher)
+        return n
+
+    await measure("sync", sync)
+    await measure("async", pooled)
+    print(publisher.info())
+    await publisher.stop()
+
+    # Drop the benchmark tasks, and only them
+    with tasks.app.connection_for_write() as conn:
+        print(f"purged[{conn.default_channel.queue_purge(QUEUE)}]")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+
+from model import SpamModel, CompactSpamModel, export_compact_model
+
+# Accuracy and throughput of the compact model at each precision
+
+data = pd.read_csv("./data/spam_data.csv")
+X = data["Message"].apply(SpamModel.preprocessor)
+y = data["Category"]
+
+# Same split as train_spam_detector.py
+X_train, X_test, y_train, y_test = train_test_split(
+    X, y, test_size=0.3, random_state=42
+)
+X_test = list(X_test)
+
+pipeline = joblib.load("spam_classifier.joblib")
+reference = pipeline.predict_proba(X_test)
+
+models = {"sklearn": pipeline}
+tmp_dir = tempfile.mkdtemp()
+for precision in ("float64", "float32", "int8"):
+    path = os.path.join(tmp_dir, precision)
+    export_compact_model(pipeline, path, precision)
+    models[precision] = CompactSpamModel(path)
+
+# Accuracy
+
+print(f"{'model':>8} {'accuracy':>9} {'agreement':>10} {'max |dp|':>9}")
+for name, model in models.items():
+    probs = model.predict_proba(X_test)
+    y_pred = np.array(pipeline.classes_)[probs.argmax(axis=1)]
+    agreement = (probs.argmax(axis=1) == reference.argmax(axis=1)).mean()
+    print(
+        f"{name:>8} {100 * accuracy_score(y_test, y_pred):8.2f}% "
+        f"{100 * agreement:9.2f}% {np.abs(probs - reference).max():9.2e}"
+    )
+
+# Throughput, messages per second of `predict_proba`
+
+batch_sizes = [1, 8, 32, 128, 512]
+print()
+print(f"{'model':>8} " + " ".join(f"{f'batch {n}':>11}" for n in batch_sizes))
+for name, model in models.items():
+    row = []
+    for n in batch_sizes:
+        batch = X_test[:n]
+        model.predict_proba(batch)  # warmup
+        repeat = max(1, 2000 // n)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            model.predict_proba(batch)
+        row.append(n * repeat / (time.perf_counter() - start))
+    print(f"{name:>8} " + " ".join(f"{r:11.0f}" for r in row))
@@ -0,0 +1,15 @@
+import joblib
+import sys
+
+from model import export_compact_model
+
+# Export the trained pipeline to the NumPy-only format served by `CompactSpamModel`
+#
+#   python export_spam_detector.py            # float64, same results as the pipeline
+#   python export_spam_detector.py float32    # or int8, see benchmark_spam_detector.py
+
+precision = sys.argv[1] if len(sys.argv) > 1 else "float64"
+
+pipeline = joblib.load("spam_classifier.joblib")
+export_compact_model(pipeline, "spam_classifier", precision)
+print(f"Exported to ./spam_classifier, precision {precision}")
@@ -3,13 +3,22 @@ import os
 MODEL_PATH = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "spam_classifier.joblib"
 )
+COMPACT_MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "spam_classifier"
+)
+REGISTRY_DIR = os.getenv(
+    "ML_REGISTRY_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "registry"),
+)
+MODEL_VERSION = os.getenv("ML_MODEL_VERSION", "1")
 
 
 class SpamModel:
     """Wrapper for loading and serving pre-trained model"""
 
-    def __init__(self):
-        self.model = self._load_model_from_path(MODEL_PATH)
+    def __init__(self, path=MODEL_PATH, version=MODEL_VERSION):
+        self.model = self._load_model_from_path(path)
+        self.version = version
 
     @staticmethod
     def _load_model_from_path(path):
@@ -29,11 +38,343 @@ class SpamModel:
 
     def predict(self, message):
         """
-        Make batch prediction on list of preprocessed feature dicts.
-        Returns class probabilities if 'return_options' is 'Prob', otherwise returns class membership predictions
+        Make prediction on a single raw message.
+        Returns the class label together with the spam probability.
+        """
+        return self.predict_many([message])[0]
+
+    def predict_many(self, messages):
+        """
+        Make predictions on a list of raw messages with a single vectorized pass,
+        labels are taken from the same probability matrix as the spam probability.
+        Returns one `{"label", "spam_probability"}` dict per message, in order.
+        """
+        messages = [self.preprocessor(message) for message in messages]
+        probs = self.model.predict_proba(messages)
+        return self._results(self.model.classes_, probs)
+
+    def _results(self, classes, probs):
+        labels = classes[probs.argmax(axis=1)]
+        return [
+            {
+                "label": str(label),
+                "spam_probability": float(prob[1]),
+                "model_version": self.version,
+            }
+            for label, prob in zip(labels, probs)
+        ]
+
+
+class CompactSpamModel(SpamModel):
+    """
+    NumPy-only serving of a model written by `export_compact_model`.
+
+    Weights are memory-mapped read-only, so worker processes share the same
+    pages and loading does not unpickle any sklearn object. Except int8
+    layers, dequantized to private float32 copies at load time: the export
+    is smaller, not the memory of each process.
+    """
+
+    def __init__(self, path=COMPACT_MODEL_PATH, version=MODEL_VERSION):
+        self._load_model_from_dir(path)
+        self.version = version
+
+    def _load_model_from_dir(self, path):
+        import json
+        import re
+        import numpy as np
+
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "vocabulary.json")) as f:
+            self.vocabulary = {token: i for i, token in enumerate(json.load(f))}
+
+        self.meta = meta
+        self.classes = np.array(meta["classes"])
+        self.token_pattern = re.compile(meta["token_pattern"])
+        self.idf = np.load(os.path.join(path, "idf.npy"), mmap_mode="r")
+        self.coefs = [self._load_coefs(path, i) for i in range(meta["n_layers"])]
+        self.intercepts = [
+            np.load(os.path.join(path, f"intercepts_{i}.npy"), mmap_mode="r")
+            for i in range(meta["n_layers"])
+        ]
+
+    @staticmethod
+    def _load_coefs(path, i):
+        import numpy as np
+
+        W = np.load(os.path.join(path, f"coefs_{i}.npy"), mmap_mode="r")
+        if W.dtype == np.int8:
+            # Dequantized once, not shared between processes like the mmap. Per
+            # batch, the cast costs more than the matmul on small batches
+            scale = np.load(os.path.join(path, f"coef_scales_{i}.npy"))
+            W = W.astype(np.float32) * scale
+        return W
+
+    def _vectorize(self, messages):
+        """
+        Same features as the fitted `TfidfVectorizer`, as a dense matrix.
+        """
+        import numpy as np
+
+        X = np.zeros((len(messages), len(self.vocabulary)), dtype=self.idf.dtype)
+        for i, message in enumerate(messages):
+            if self.meta["lowercase"]:
+                message = message.lower()
+            for token in self.token_pattern.findall(message):
+                j = self.vocabulary.get(token)
+                if j is not None:
+                    X[i, j] += 1
+
+        if self.meta["binary"]:
+            X = (X > 0).astype(X.dtype)
+        if self.meta["sublinear_tf"]:
+            nonzero = X > 0
+            X[nonzero] = np.log(X[nonzero]) + 1
+        X *= self.idf
+
+        norm = self.meta["norm"]
+        if norm is not None:
+            if norm == "l2":
+                lengths = np.sqrt((X * X).sum(axis=1, keepdims=True))
+            else:
+                lengths = np.abs(X).sum(axis=1, keepdims=True)
+            lengths[lengths == 0] = 1
+            X /= lengths
+        return X
+
+    def predict_proba(self, messages):
+        import numpy as np
+
+        activations = {
+            "identity": lambda z: z,
+            "logistic": lambda z: 1 / (1 + np.exp(-z)),
+            "tanh": np.tanh,
+            "relu": lambda z: np.maximum(z, 0),
+        }
+        hidden = activations[self.meta["activation"]]
+
+        a = self._vectorize(messages)
+        for i, (W, b) in enumerate(zip(self.coefs, self.intercepts)):
+            a = a @ W + b
+            if i < len(self.coefs) - 1:
+                a = hidden(a)
+
+        if self.meta["out_activation"] == "softmax":
+            a = np.exp(a - a.max(axis=1, keepdims=True))
+            return a / a.sum(axis=1, keepdims=True)
+
+        p = activations[self.meta["out_activation"]](a)
+        return np.hstack([1 - p, p])
+
+    def predict_many(self, messages):
+        messages = [self.preprocessor(message) for message in messages]
+        probs = self.predict_proba(messages)
+        return self._results(self.classes, probs)
+
+
+class ModelRegistry:
+    """
+    Directory of versioned model artifacts, `manifest.json` names the current one:
+
+        {"current": "v2", "versions": {"v2": {"path": "v2/spam_classifier.joblib", "format": "joblib"}}}
+    """
+
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+
+    def manifest(self):
+        import json
+
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def current_version(self):
+        return self.manifest()["current"]
+
+    def load(self, version=None):
+        """
+        Load `version`, or the current one, as a `SpamModel`/`CompactSpamModel`.
         """
-        message = self.preprocessor(message)
-        label = self.model.predict([message])[0]
-        spam_prob = self.model.predict_proba([message])
+        manifest = self.manifest()
+        version = version or manifest["current"]
+        entry = manifest["versions"][version]
+        path = os.path.join(self.root, entry["path"])
+
+        model_class = CompactSpamModel if entry["format"] == "compact" else SpamModel
+        return model_class(path, version=version)
+
+    def publish(self, version, artifact, format="joblib", current=True):
+        """
+        Copy `artifact` (a joblib file or a compact model directory) into the
+        registry and make it the current version. The manifest is replaced
+        atomically, so workers never read a half-written one.
+        """
+        import json
+        import shutil
+
+        os.makedirs(os.path.join(self.root, version), exist_ok=True)
+        target = os.path.join(version, os.path.basename(os.path.normpath(artifact)))
+        if os.path.isdir(artifact):
+            shutil.copytree(
+                artifact, os.path.join(self.root, target), dirs_exist_ok=True
+            )
+        else:
+            shutil.copy2(artifact, os.path.join(self.root, target))
+
+        if os.path.exists(self.manifest_path):
+            manifest = self.manifest()
+        else:
+            manifest = {"current": version, "versions": {}}
+        manifest["versions"][version] = {"path": target, "format": format}
+        if current:
+            manifest["current"] = version
+
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+
+class RegistrySpamModel:
+    """
+    Serves the current version of a `ModelRegistry` and hot-swaps new ones.
+
+    At most every `poll_interval` seconds a prediction checks the manifest,
+    a new version is loaded in a background thread and swapped in with a
+    single reference assignment, so every call runs on exactly one version.
+    """
+
+    preprocessor = staticmethod(SpamModel.preprocessor)
+
+    def __init__(self, root=REGISTRY_DIR, poll_interval=5.0):
+        import threading
+
+        self.registry = ModelRegistry(root)
+        self.poll_interval = poll_interval
+        self._model = self.registry.load()
+        self._manifest_mtime = os.stat(self.registry.manifest_path).st_mtime
+        self._checked_at = 0.0
+        self._loading = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self._model.version
+
+    def predict(self, message):
+        return self.predict_many([message])[0]
+
+    def predict_many(self, messages):
+        self._maybe_reload()
+        model = self._model
+        return model.predict_many(messages)
+
+    def _maybe_reload(self):
+        import threading
+        import time
+
+        now = time.monotonic()
+        if now - self._checked_at < self.poll_interval:
+            return
+        self._checked_at = now
+
+        try:
+            mtime = os.stat(self.registry.manifest_path).st_mtime
+        except OSError:
+            return
+        if mtime == self._manifest_mtime:
+            return
+
+        with self._lock:
+            # The thread must belong to this process, a forked child starts its own
+            if self._loading is not None and self._loading.is_alive():
+                return
+            self._manifest_mtime = mtime
+            self._loading = threading.Thread(target=self._reload, daemon=True)
+            self._loading.start()
+
+    def _reload(self):
+        try:
+            version = self.registry.current_version()
+            if version == self._model.version:
+                return
+            print(f"RegistrySpamModel - loading version[{version}]")
+            model = self.registry.load(version)
+            model.predict_many(["warmup"])
+            self._model = model
+            print(f"RegistrySpamModel - swapped to version[{version}]")
+        except Exception as e:
+            print(f"RegistrySpamModel - reload failed[{e}]")
+
+
+def export_compact_model(pipeline, path=COMPACT_MODEL_PATH, precision="float64"):
+    """
+    Write the TF-IDF vocabulary, IDF vector and MLP weights of a fitted
+    `Pipeline([("vectorizer", TfidfVectorizer), ("nn", MLPClassifier)])` as
+    plain `.npy`/`.json` files that `CompactSpamModel` can memory-map.
+
+    `precision` is `float64`, `float32` or `int8`, the latter stores hidden
+    layers as int8 with a float32 scale per unit, and computes in float32.
+    """
+    import json
+    import numpy as np
+
+    if precision not in ("float64", "float32", "int8"):
+        raise ValueError(f"Unsupported precision[{precision}]")
+    dtype = np.float64 if precision == "float64" else np.float32
+
+    tfidf = pipeline.named_steps["vectorizer"]
+    nn = pipeline.named_steps["nn"]
+
+    if (
+        tfidf.analyzer != "word"
+        or tuple(tfidf.ngram_range) != (1, 1)
+        or tfidf.tokenizer is not None
+        or tfidf.preprocessor is not None
+        or tfidf.strip_accents is not None
+        or tfidf.stop_words is not None
+    ):
+        raise ValueError(
+            "Only word unigram TfidfVectorizer without custom text processing can be exported"
+        )
+
+    os.makedirs(path, exist_ok=True)
+
+    vocabulary = sorted(tfidf.vocabulary_, key=tfidf.vocabulary_.get)
+    with open(os.path.join(path, "vocabulary.json"), "w") as f:
+        json.dump(vocabulary, f)
+
+    idf = tfidf.idf_ if tfidf.use_idf else np.ones(len(vocabulary))
+    np.save(os.path.join(path, "idf.npy"), np.ascontiguousarray(idf, dtype=dtype))
+    for i, (W, b) in enumerate(zip(nn.coefs_, nn.intercepts_)):
+        if precision == "int8" and i < len(nn.coefs_) - 1:
+            # Symmetric per-unit quantization, the output layer stays float32
+            scale = np.abs(W).max(axis=0) / 127
+            scale[scale == 0] = 1
+            W = np.round(W / scale).astype(np.int8)
+            np.save(os.path.join(path, f"coef_scales_{i}.npy"), scale.astype(dtype))
+        np.save(
+            os.path.join(path, f"coefs_{i}.npy"),
+            np.ascontiguousarray(W, dtype=W.dtype if W.dtype == np.int8 else dtype),
+        )
+        np.save(
+            os.path.join(path, f"intercepts_{i}.npy"),
+            np.ascontiguousarray(b, dtype=dtype),
+        )
 
-        return {"label": label, "spam_probability": spam_prob[0][1]}
+    meta = {
+        "classes": [str(c) for c in nn.classes_],
+        "n_layers": len(nn.coefs_),
+        "activation": nn.activation,
+        "out_activation": nn.out_activation_,
+        "token_pattern": tfidf.token_pattern,
+        "lowercase": tfidf.lowercase,
+        "binary": tfidf.binary,
+        "sublinear_tf": tfidf.sublinear_tf,
+        "norm": tfidf.norm,
+        "precision": precision,
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
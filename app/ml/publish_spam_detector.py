@@ -0,0 +1,15 @@
+import sys
+
+from model import ModelRegistry
+
+# Publish the trained model as a new version of the registry served with `ML_MODEL_FORMAT=registry`
+#
+#   python publish_spam_detector.py v2            # ./spam_classifier.joblib
+#   python publish_spam_detector.py v2 compact    # ./spam_classifier, see export_spam_detector.py
+
+version = sys.argv[1]
+format = sys.argv[2] if len(sys.argv) > 2 else "joblib"
+artifact = "spam_classifier" if format == "compact" else "spam_classifier.joblib"
+
+ModelRegistry().publish(version, artifact, format)
+print(f"Published {artifact} as version {version}")
@@ -0,0 +1,59 @@
+import fakeredis
+import pytest
+from celery.backends.redis import RedisBackend
+
+from app.celery_app import memo
+from app.celery_app.app import app
+from app.celery_app.memo import Memoized
+
+calls = []
+
+
+@app.task(base=Memoized)
+def double(x: int, factor: int = 2) -> int:
+    calls.append(x)
+    if x < 0:
+        raise ValueError(x)
+    return factor * x
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(RedisBackend, "client", property(lambda self: client))
+    monkeypatch.setattr(memo, "MEMO_MAX_ENTRIES", 2)
+    calls.clear()
+    return client
+
+
+def test_memoized(client):
+    # Positional, keyword or default, the same call
+    assert [double(1), double(x=1), double(1, factor=2), double(2)] == [2, 2, 2, 4]
+    assert calls == [1, 2]
+
+    with pytest.raises(ValueError):
+        double(-1)
+    with pytest.raises(ValueError):
+        double(-1)
+    assert calls == [1, 2, -1, -1]
+
+    # The oldest entry is evicted
+    double(3)
+    assert client.zcard(Memoized.index) == 2
+    assert double(1) == 2
+    assert calls == [1, 2, -1, -1, 3, 1]
+
+    # Runs again rather than failing on an entry it can't decode
+    client.set(double.memo_key((3,), {}), b"\xff not json")
+    assert double(3) == 6
+    assert calls == [1, 2, -1, -1, 3, 1, 3]
+
+
+def test_fingerprint(tmp_path):
+    video = tmp_path / "input.mp4"
+    video.write_bytes(b"v1")
+    before = memo.fingerprint({"video_path": str(video)})
+    assert memo.fingerprint({"video_path": str(video)}) == before
+
+    video.write_bytes(b"v2 changed")
+    assert memo.fingerprint({"video_path": str(video)}) != before
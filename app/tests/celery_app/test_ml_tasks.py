@@ -0,0 +1,74 @@
+import fakeredis
+import pytest
+
+from app.celery_app import ml_tasks
+from celery.backends.redis import RedisBackend
+from celery.exceptions import TaskRevokedError
+from celery_batches import SimpleRequest
+from celery.result import AsyncResult
+
+
+def test_detect_spam():
+    task: AsyncResult = ml_tasks.detect_spam.delay("hello, how are you?")
+    result = task.get()
+    print(f"test_detect_spam() - result[{result}]")
+    assert result["label"] == "ham"
+
+
+def test_detect_spam_batch():
+    msgs = ["hello, how are you?", "WINNER!! Claim your free prize now, txt 80082"]
+    tasks = [ml_tasks.detect_spam_batch.delay(msg) for msg in msgs]
+    results = [task.get() for task in tasks]
+    print(f"test_detect_spam_batch() - results[{results}]")
+    assert [r["label"] for r in results] == ["ham", "spam"]
+
+
+def test_detect_spam_many():
+    msgs = ["hello, how are you?", "WINNER!! Claim your free prize now, txt 80082"]
+    task: AsyncResult = ml_tasks.detect_spam_many.delay(msgs)
+    result = task.get()
+    print(f"test_detect_spam_many() - result[{result}]")
+    assert [r["label"] for r in result] == ["ham", "spam"]
+
+
+def test_detect_spam_expired():
+    # Past its deadline the worker drops the task without running the model
+    for task in [ml_tasks.detect_spam, ml_tasks.detect_spam_batch]:
+        result: AsyncResult = task.apply_async(("hello, how are you?",), expires=-1)
+        with pytest.raises(TaskRevokedError):
+            result.get()
+
+
+def test_detect_spam_batch_failure(monkeypatch):
+    # Run in-process, every request of a failed batch is stored as failed
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(RedisBackend, "client", property(lambda self: client))
+
+    class BrokenModel:
+        def predict_many(self, msgs):
+            raise ValueError("model broken")
+
+    monkeypatch.setattr(
+        ml_tasks.BatchPredictTask, "get_model", lambda self, name=None: BrokenModel()
+    )
+    task = ml_tasks.detect_spam_batch
+    requests = [
+        SimpleRequest(
+            f"r{i}",
+            task.name,
+            (f"msg {i}",),
+            {"model": model},
+            {},
+            "w",
+            False,
+            None,
+            None,
+            {},
+        )
+        for i, model in enumerate(["spam", "spam", "phishing"])
+    ]
+    task.run(requests)
+
+    for request in requests:
+        meta = task.backend.get_task_meta(request.id)
+        assert meta["status"] == "FAILURE"
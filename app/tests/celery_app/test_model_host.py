@@ -0,0 +1,43 @@
+import numpy as np
+
+from app.celery_app.model_host import ModelHost, estimate_size
+
+MODEL_PY = """
+import numpy as np
+
+
+class ArrayModel:
+    def __init__(self, size=1024):
+        self.weights = np.zeros(size, dtype=np.uint8)
+"""
+
+
+def test_estimate_size():
+    weights = np.zeros(1 << 20, dtype=np.uint8)
+    size = estimate_size({"weights": weights, "view": weights[:10]})
+    assert (1 << 20) <= size < (1 << 20) + 4096
+
+
+def test_model_host_lru_eviction(tmp_path):
+    (tmp_path / "array_model.py").write_text(MODEL_PY)
+    path = str(tmp_path)
+    host = ModelHost(
+        {
+            "a": (path, "array_model", "ArrayModel", {"size": 1 << 20}),
+            "b": (path, "array_model", "ArrayModel", {"size": 1 << 20}),
+            "c": (path, "array_model", "ArrayModel", {"size": 1 << 20}),
+        },
+        memory_budget=(5 << 20) // 2,
+    )
+
+    a = host.get("a")
+    host.get("b")
+    assert host.get("a") is a
+    host.get("c")  # evicts `b`, the least recently used
+
+    info = host.info()
+    assert [name for name, m in info["models"].items() if m["resident"]] == ["a", "c"]
+    assert info["models"]["b"]["evictions"] == 1
+    assert info["models"]["a"]["hits"] == 1
+    assert info["resident_size"] <= host.memory_budget
+    assert info["models"]["c"]["load_time"] > 0
@@ -1,3 +1,8 @@
+import os
+import uuid
+
+import pytest
+
 from app.celery_app import tasks
 from celery.result import AsyncResult
 from celery import chord
@@ -35,4 +40,77 @@ def test_mapreduce():
     task: AsyncResult = tasks.mapreduce.delay(data)
     result = task.get()
     print(f"test_mapreduce_1() - result[{result}]")
-    # assert result == 20
+    assert result == 20
+
+
+def test_mapreduce_tree():
+    # 100 chunks, reduced by 3 levels of chords
+    data = ["x" * (i % 7) for i in range(10000)]
+    task: AsyncResult = tasks.mapreduce.delay(data, chunk_size=100, fan_in=5)
+    result = task.get()
+    print(f"test_mapreduce_tree() - result[{result}]")
+    assert result == sum(len(x) for x in data)
+
+
+def test_score_csv():
+    # Files of the data directory shared with the worker
+    name = f"test-{uuid.uuid4()}"
+    input_path = tasks.data_path(f"{name}.csv")
+    output_path = tasks.data_path(f"{name}.scored.csv")
+    with open(input_path, "w") as f:
+        f.write("Message\nhello world\nWINNER!! Claim your free prize\n")
+    try:
+        task: AsyncResult = tasks.score_csv.delay(
+            f"{name}.csv", f"{name}.scored.csv", chunk_size=1
+        )
+        result = task.get()
+        print(f"test_score_csv() - result[{result}]")
+        assert result["rows"] == 2
+        with open(output_path) as f:
+            assert f.read().startswith("Message,label,spam_probability")
+    finally:
+        for path in (input_path, output_path, f"{output_path}.checkpoint"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def test_data_path():
+    assert tasks.data_path("spam_data.csv").endswith("spam_data.csv")
+    for name in ("../../app/main.py", "/etc/passwd", "", "."):
+        with pytest.raises(ValueError):
+            tasks.data_path(name)
+
+
+def test_score_csv_bounds():
+    for chunk_size, max_in_flight in ((0, 4), (1000, 0), (-1, 4)):
+        with pytest.raises(ValueError):
+            tasks.score_csv.run(
+                "spam_data.csv",
+                "scored.csv",
+                chunk_size=chunk_size,
+                max_in_flight=max_in_flight,
+            )
+
+
+def test_chunked():
+    data = [f"message {i}" for i in range(250)]
+    task: AsyncResult = tasks.chunked(tasks.length, data, chunk_size=100).delay()
+    result = task.get()
+    print(f"test_chunked() - result[{result[:5]}]")
+    assert result == [len(x) for x in data]
+
+
+def test_chunked_queue():
+    from app.celery_app import ml_tasks
+
+    signature = tasks.chunked(ml_tasks.detect_spam, ["msg"] * 10, chunk_size=4)
+    assert len(signature.tasks) == 3
+    assert all(t.options["queue"] == ml_tasks.ML_QUEUE for t in signature.tasks)
+
+
+def test_pipeline():
+    task: AsyncResult = tasks.pipeline.delay("input.mp4")
+    result = task.get()
+    print(f"test_pipeline() - result[{result}]")
+    assert result["mark"] == "input.out.mark.mp4"
+    assert len(result["clip"]) == 5
@@ -0,0 +1,22 @@
+import pytest
+
+from app.celery_app import tasks
+from app.celery_app.workflow import Workflow
+
+
+def test_workflow_graph():
+    workflow = tasks.video_workflow("input.mp4")
+    assert workflow.parents == {
+        "convert": [],
+        "analyze": [],
+        "mark": ["convert"],
+        "clip": ["convert", "analyze"],
+    }
+
+    nodes = {name: tasks.add.s() for name in ("a", "b", "c")}
+    with pytest.raises(ValueError, match="cycle"):
+        Workflow(nodes, {"a": ["b"], "b": ["c"], "c": ["b"]})
+    with pytest.raises(ValueError, match="unknown"):
+        Workflow(nodes, {"a": ["d"]})
+    with pytest.raises(ValueError, match="not a parent"):
+        Workflow(nodes, {"a": ["b"]}, foreach={"b": "c"})
@@ -0,0 +1,103 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.neural_network import MLPClassifier
+from sklearn.pipeline import Pipeline
+
+from ml.model import (
+    SpamModel,
+    CompactSpamModel,
+    ModelRegistry,
+    RegistrySpamModel,
+    export_compact_model,
+)
+
+DATA_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "ml", "data", "spam_data.csv"
+)
+
+
+@pytest.fixture(scope="module")
+def data():
+    data = pd.read_csv(DATA_PATH)
+    return data["Message"].apply(SpamModel.preprocessor), data["Category"]
+
+
+@pytest.fixture(scope="module", params=[{}, {"sublinear_tf": True, "lowercase": True}])
+def spam_model(request, data):
+    X, y = data
+    tfidf = TfidfVectorizer(strip_accents=None, lowercase=False, max_features=300)
+    tfidf.set_params(**request.param)
+    pipeline = Pipeline(
+        [
+            ("vectorizer", tfidf),
+            (
+                "nn",
+                MLPClassifier(hidden_layer_sizes=(32, 32), max_iter=20, random_state=0),
+            ),
+        ]
+    )
+    pipeline.fit(X[:1000], y[:1000])
+
+    model = SpamModel.__new__(SpamModel)
+    model.model = pipeline
+    model.version = "test"
+    return model
+
+
+def test_predict_many(spam_model, data):
+    msgs = list(data[0][1000:1100])
+    results = spam_model.predict_many(msgs)
+    assert len(results) == len(msgs)
+    assert results[3] == spam_model.predict(msgs[3])
+    assert [r["label"] for r in results] == list(spam_model.model.predict(msgs))
+
+
+def test_compact_model_parity(spam_model, data, tmp_path):
+    export_compact_model(spam_model.model, str(tmp_path))
+    compact_model = CompactSpamModel(str(tmp_path))
+
+    msgs = list(data[0][1000:2000]) + ["", "<b>FREE</b> :-) prize!!"]
+    expected = spam_model.model.predict_proba([SpamModel.preprocessor(m) for m in msgs])
+    probs = compact_model.predict_proba([SpamModel.preprocessor(m) for m in msgs])
+    np.testing.assert_allclose(probs, expected, atol=1e-9)
+
+    results = compact_model.predict_many(msgs)
+    assert [r["label"] for r in results] == [
+        r["label"] for r in spam_model.predict_many(msgs)
+    ]
+
+
+def test_registry_hot_swap(spam_model, tmp_path):
+    import joblib
+    import time
+
+    joblib.dump(spam_model.model, tmp_path / "spam_classifier.joblib")
+    export_compact_model(spam_model.model, str(tmp_path / "spam_classifier"))
+
+    registry = ModelRegistry(str(tmp_path / "registry"))
+    registry.publish("v1", str(tmp_path / "spam_classifier.joblib"))
+    model = RegistrySpamModel(registry.root, poll_interval=0)
+    assert model.predict("hello")["model_version"] == "v1"
+
+    registry.publish("v2", str(tmp_path / "spam_classifier"), "compact")
+    os.utime(registry.manifest_path, (time.time() + 1, time.time() + 1))
+    model.predict("hello")
+    model._loading.join()
+    assert model.predict("hello")["model_version"] == "v2"
+    assert isinstance(model._model, CompactSpamModel)
+
+
+@pytest.mark.parametrize("precision, atol", [("float32", 1e-4), ("int8", 5e-2)])
+def test_compact_model_reduced_precision(spam_model, data, tmp_path, precision, atol):
+    export_compact_model(spam_model.model, str(tmp_path), precision)
+    compact_model = CompactSpamModel(str(tmp_path))
+    assert compact_model.coefs[0].dtype == np.float32
+
+    msgs = list(data[0][1000:2000])
+    expected = spam_model.model.predict_proba(msgs)
+    probs = compact_model.predict_proba(msgs)
+    np.testing.assert_allclose(probs, expected, atol=atol)
+    assert (probs.argmax(axis=1) == expected.argmax(axis=1)).mean() > 0.99
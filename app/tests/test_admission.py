@@ -0,0 +1,77 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.admission import AdmissionController, Overloaded
+from app.celery_app import email_tasks, ml_tasks, tasks
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        "app.admission.redis.Redis.from_url",
+        lambda url: fakeredis.aioredis.FakeRedis(server=server),
+    )
+    return server
+
+
+def test_admission(server):
+    async def run():
+        broker = fakeredis.aioredis.FakeRedis(server=server)
+        await broker.rpush("ml_service", *["m"] * 3)
+        await broker.rpush("ml_service\x06\x163", "m")
+
+        admission = AdmissionController(
+            ml_tasks.app,
+            limits={"ml_service": {"depth": 4}, "email_service": {"in_flight": 1}},
+            max_depth=0,
+            max_in_flight=0,
+            poll_interval=60,
+        )
+        await admission.start()
+        await admission.poll()
+        assert admission.depth == {"celery": 0, "email_service": 0, "ml_service": 4}
+
+        with pytest.raises(Overloaded) as e:
+            async with admission.admit(ml_tasks.detect_spam):
+                pass
+        assert e.value.status_code == 503
+
+        # Unlimited
+        async with admission.admit(tasks.echo):
+            pass
+
+        # A batch is admitted only if all of it fits
+        admission.limits["celery"] = {"depth": 4}
+        with pytest.raises(Overloaded):
+            async with admission.admit(tasks.echo, count=4):
+                pass
+        async with admission.admit(tasks.echo, count=3):
+            pass
+
+        async with admission.admit(email_tasks.send_email):
+            with pytest.raises(Overloaded) as e:
+                async with admission.admit(email_tasks.send_email):
+                    pass
+            assert e.value.status_code == 429
+        async with admission.admit(email_tasks.send_email):
+            pass
+
+        info = admission.info()
+        await admission.stop()
+        return info
+
+    info = asyncio.run(run())
+    assert info["ml_service"]["rejected_depth"] == 1
+    assert info["celery"]["rejected_depth"] == 1
+    assert info["email_service"] == {
+        "depth": 2,
+        "in_flight": 0,
+        "max_depth": 0,
+        "max_in_flight": 1,
+        "admitted": 2,
+        "rejected_depth": 0,
+        "rejected_in_flight": 1,
+    }
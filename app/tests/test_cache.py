@@ -0,0 +1,32 @@
+import asyncio
+
+from app.cache import PredictionCache
+
+
+def test_prediction_cache_lru():
+    cache = PredictionCache(maxsize=2, redis_url=None)
+
+    async def run():
+        await cache.set("Hello", {"label": "ham"})
+        await cache.set("Free prize", {"label": "spam"})
+        assert await cache.get("<b>hello</b>") == {"label": "ham"}
+        await cache.set("WIN", {"label": "spam"})
+        assert await cache.get("Free prize") is None
+
+    asyncio.run(run())
+    assert cache.info()["local_hits"] == 1
+    assert cache.info()["misses"] == 1
+    assert cache.info()["size"] == 2
+
+
+def test_prediction_cache_model_version():
+    cache = PredictionCache(redis_url=None)
+
+    async def run():
+        await cache.set("Hello", {"label": "ham", "model_version": "v1"})
+        assert await cache.get("Hello") is not None
+        await cache.set("WIN", {"label": "spam", "model_version": "v2"})
+        assert await cache.get("Hello") is None
+        assert await cache.get("WIN") is not None
+
+    asyncio.run(run())
@@ -0,0 +1,37 @@
+import asyncio
+
+from app.local_inference import LocalModelPool
+
+
+def test_local_model_pool():
+    async def run():
+        pool = LocalModelPool(workers=1, max_pending=1)
+        # Not started, offloaded
+        assert await pool.predict("hello") is None
+        await pool.start()
+
+        # The second request finds the pool saturated by the first
+        first, second = await asyncio.gather(
+            pool.predict_many(["hello", "WINNER!! Claim your free prize"]),
+            pool.predict("hello"),
+        )
+        assert [p["label"] for p in first] == ["ham", "spam"]
+        assert second is None
+        assert (await pool.predict("hello"))["label"] == "ham"
+
+        info = pool.info()
+        pool.shutdown()
+        # Shut down, offloaded again
+        assert await pool.predict("hello") is None
+        pool.shutdown()
+        return info, pool.info()
+
+    info, after = asyncio.run(run())
+    assert info == {
+        "local": 2,
+        "offloaded": 2,
+        "workers": 1,
+        "pending": 0,
+        "max_pending": 1,
+    }
+    assert after["offloaded"] == 3
@@ -0,0 +1,67 @@
+import itertools
+import time
+
+from app.celery_app.app import app
+from app.monitor import ClusterMonitor
+
+clock = itertools.count(1)
+
+
+def event(type, **fields):
+    tick = next(clock)
+    return {
+        "type": type,
+        "clock": tick,
+        "timestamp": time.time() + tick,
+        "local_received": time.time(),
+        **fields,
+    }
+
+
+def test_cluster_monitor():
+    monitor = ClusterMonitor(app)
+
+    monitor._on_event(event("worker-heartbeat", hostname="ml@host", active=1))
+    for i in range(5):
+        monitor._on_event(
+            event(
+                "task-received",
+                uuid=f"t{i}",
+                name="app.celery_app.ml_tasks.detect_spam",
+                hostname="ml@host",
+                args="('hi',)",
+                kwargs="{}",
+            )
+        )
+    monitor._on_event(event("task-started", uuid="t0", hostname="ml@host"))
+    monitor._on_event(
+        event("task-succeeded", uuid="t1", hostname="ml@host", result="'ham'")
+    )
+
+    # A task started before the monitor, only known from `inspect`
+    monitor.merge(
+        active={
+            "default@host": [
+                {"id": "t9", "name": "app.celery_app.tasks.wait", "args": [10]}
+            ]
+        },
+        reserved={},
+        scheduled={},
+        registered={"default@host": ["app.celery_app.tasks.wait"]},
+    )
+
+    workers = monitor.workers()
+    assert set(workers) == {"ml@host", "default@host"}
+    assert workers["default@host"]["registered"] == ["app.celery_app.tasks.wait"]
+
+    assert monitor.tasks()["total"] == 6
+    assert sorted(t["uuid"] for t in monitor.tasks(state="STARTED")["tasks"]) == [
+        "t0",
+        "t9",
+    ]
+    assert monitor.tasks(state="SUCCESS")["tasks"][0]["result"] == "'ham'"
+    assert monitor.tasks(worker="default@host")["total"] == 1
+
+    page = monitor.tasks(name="app.celery_app.ml_tasks.detect_spam", offset=1, limit=2)
+    assert page["total"] == 5
+    assert [t["uuid"] for t in page["tasks"]] == ["t0", "t4"]
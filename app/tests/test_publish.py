@@ -0,0 +1,151 @@
+import asyncio
+
+import fakeredis
+import pytest
+from celery import Celery
+from celery.backends.redis import RedisBackend
+from celery.result import AsyncResult
+
+from app.publish import AsyncPublisher, PublishError
+
+
+def test_async_publisher():
+    app = Celery(broker="memory://", backend="cache+memory://")
+
+    @app.task()
+    def echo(msg: str) -> str:
+        return msg
+
+    async def run():
+        publisher = AsyncPublisher(workers=1, max_batch=16)
+        await publisher.start()
+        results = await asyncio.gather(
+            *[publisher.delay(echo, f"msg{i}") for i in range(100)]
+        )
+        await publisher.stop()
+        return publisher, results
+
+    publisher, results = asyncio.run(run())
+    assert len({r.id for r in results}) == 100
+    assert publisher.info()["published"] == 100
+    assert publisher.info()["batches"] < 100
+
+    with app.connection_for_write() as conn:
+        queue = conn.SimpleQueue("celery")
+        assert queue.qsize() == 100
+
+
+def test_apply_many():
+    app = Celery(broker="memory://", backend="cache+memory://")
+
+    @app.task()
+    def echo(msg: str) -> str:
+        return msg
+
+    async def run():
+        publisher = AsyncPublisher(workers=1, max_batch=64)
+        await publisher.start()
+        results = await publisher.apply_many(
+            [
+                (echo, (f"msg{i}",), None, {"group_id": "g1", "queue": "bulk"})
+                for i in range(100)
+            ]
+        )
+        await publisher.stop()
+        return publisher, results
+
+    publisher, results = asyncio.run(run())
+    assert len({r.id for r in results}) == 100
+    assert publisher.info()["batches"] == 2
+
+    with app.connection_for_write() as conn:
+        message = conn.SimpleQueue("bulk").get(timeout=1)
+        assert message.headers["group"] == "g1"
+        assert message.headers["argsrepr"] == "('msg0',)"
+
+
+def test_apply_many_partial_failure():
+    app = Celery(broker="memory://", backend="cache+memory://")
+
+    @app.task()
+    def echo(msg: str) -> str:
+        return msg
+
+    async def run():
+        publisher = AsyncPublisher(workers=1, max_batch=64)
+        await publisher.start()
+        # Not serializable, fails on its own
+        calls = [(echo, ("msg",), None, {"queue": "partial"})] * 3
+        calls.insert(1, (echo, (object(),), None, {"queue": "partial"}))
+        try:
+            with pytest.raises(PublishError) as e:
+                await publisher.apply_many(calls)
+        finally:
+            await publisher.stop()
+        return e.value
+
+    error = asyncio.run(run())
+    assert len(error.results) == 3
+    assert len(error.errors) == 1
+
+
+def test_stop_resolves_queued():
+    app = Celery(broker="memory://", backend="cache+memory://")
+
+    @app.task()
+    def echo(msg: str) -> str:
+        return msg
+
+    async def run():
+        publisher = AsyncPublisher(workers=1, max_batch=4)
+        await publisher.start()
+        calls = [
+            asyncio.ensure_future(
+                publisher.apply_async(echo, ("msg",), queue="stopped")
+            )
+            for _ in range(40)
+        ]
+        await asyncio.sleep(0)
+        await publisher.stop()
+        results = await asyncio.wait_for(
+            asyncio.gather(*calls, return_exceptions=True), 1
+        )
+        with pytest.raises(RuntimeError):
+            await publisher.delay(echo, "msg")
+        return results
+
+    # Published, or failed if still queued, none left waiting
+    results = asyncio.run(run())
+    assert all(isinstance(r, (AsyncResult, RuntimeError)) for r in results)
+
+
+def test_publish_unsubscribes(monkeypatch):
+    app = Celery(broker="memory://", backend="redis://localhost:6379/0")
+    monkeypatch.setattr(RedisBackend, "client", fakeredis.FakeStrictRedis())
+    # `app.backend` is one per thread, the publisher's ones
+    backends = set()
+    on_task_call = RedisBackend.on_task_call
+
+    def record(self, producer, task_id):
+        backends.add(self)
+        on_task_call(self, producer, task_id)
+
+    monkeypatch.setattr(RedisBackend, "on_task_call", record)
+
+    @app.task()
+    def echo(msg: str) -> str:
+        return msg
+
+    async def run():
+        publisher = AsyncPublisher(workers=2, max_batch=8)
+        await publisher.start()
+        results = await asyncio.gather(
+            *[publisher.apply_async(echo, ("msg",), queue="sub") for _ in range(50)]
+        )
+        await publisher.stop()
+        return results
+
+    results = asyncio.run(run())
+    assert len(results) == 50
+    assert backends
+    assert all(not b.result_consumer.subscribed_to for b in backends)
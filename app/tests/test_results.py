@@ -0,0 +1,214 @@
+import asyncio
+import json
+
+import fakeredis
+import pytest
+from kombu.exceptions import DecodeError
+
+from app.celery_app import ml_tasks, tasks, workflow
+from app.results import ResultWaiter
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        "app.results.redis.Redis.from_url",
+        lambda url: fakeredis.aioredis.FakeRedis(server=server),
+    )
+    return server
+
+
+def test_result_waiter(server):
+    backend = ml_tasks.app.backend
+
+    async def store(redis, task_id, status, result):
+        payload = backend.encode(
+            {"status": status, "result": result, "task_id": task_id}
+        )
+        await redis.set(backend.task_keyprefix + task_id.encode(), payload)
+        await redis.publish(backend.task_keyprefix + task_id.encode(), payload)
+
+    async def run():
+        redis = fakeredis.aioredis.FakeRedis(server=server)
+        waiter = ResultWaiter(ml_tasks.app)
+        await waiter.start()
+
+        # Stored before anyone waits
+        await store(redis, "t1", "SUCCESS", 1)
+        assert await waiter.wait("t1", 1) == 1
+
+        async def complete_later():
+            await asyncio.sleep(0.1)
+            await store(redis, "t2", "PROGRESS", {"current": 50, "total": 100})
+            await store(redis, "t2", "SUCCESS", 2)
+
+        asyncio.create_task(complete_later())
+        assert (
+            await asyncio.gather(*[waiter.wait("t2", 1) for _ in range(50)]) == [2] * 50
+        )
+
+        with pytest.raises(asyncio.TimeoutError):
+            await waiter.wait("t3", 0.1)
+
+        await store(
+            redis,
+            "t4",
+            "FAILURE",
+            {
+                "exc_type": "ValueError",
+                "exc_message": ["bad"],
+                "exc_module": "builtins",
+            },
+        )
+        with pytest.raises(ValueError):
+            await waiter.wait("t4", 1)
+
+        # A result that can't be decoded fails its waiters, not the reader
+        async def publish_bad():
+            await asyncio.sleep(0.1)
+            await redis.publish(backend.task_keyprefix + b"t5", b"not json")
+
+        asyncio.create_task(publish_bad())
+        with pytest.raises(DecodeError):
+            await waiter.wait("t5", 1)
+        await store(redis, "t6", "SUCCESS", 6)
+        assert await waiter.wait("t6", 1) == 6
+
+        assert waiter.info() == {
+            "resolved": 4,
+            "timeouts": 1,
+            "reads": 0,
+            "pending": 0,
+        }
+        await waiter.stop()
+
+    asyncio.run(run())
+
+
+def test_read_many(server):
+    backend = ml_tasks.app.backend
+
+    async def run():
+        redis = fakeredis.aioredis.FakeRedis(server=server)
+        for task_id, meta in [
+            (
+                "t1",
+                {"status": "SUCCESS", "result": 1, "date_done": "2024-01-01T00:00:00"},
+            ),
+            ("t2", {"status": "PROGRESS", "result": {"current": 50, "total": 100}}),
+            (
+                "t3",
+                {
+                    "status": "FAILURE",
+                    "result": {
+                        "exc_type": "ValueError",
+                        "exc_message": ["bad"],
+                        "exc_module": "builtins",
+                    },
+                },
+            ),
+        ]:
+            payload = backend.encode({**meta, "task_id": task_id})
+            await redis.set(backend.task_keyprefix + task_id.encode(), payload)
+
+        waiter = ResultWaiter(ml_tasks.app)
+        await waiter.start()
+        tasks = await waiter.read_many(["t1", "t2", "t3", "t4"])
+        await waiter.stop()
+        return tasks
+
+    tasks = asyncio.run(run())
+    assert [(t["task_id"], t["status"]) for t in tasks] == [
+        ("t1", "SUCCESS"),
+        ("t2", "PROGRESS"),
+        ("t3", "FAILURE"),
+        ("t4", "PENDING"),
+    ]
+    assert tasks[0]["result"] == 1
+    assert tasks[0]["date_done"] == "2024-01-01T00:00:00"
+    assert tasks[1]["result"] == {"current": 50, "total": 100}
+    assert tasks[2]["result"] == "ValueError('bad')"
+    assert tasks[3]["result"] is None
+
+
+def test_watch(server):
+    backend = ml_tasks.app.backend
+
+    async def store(redis, task_id, status, result):
+        payload = backend.encode(
+            {"status": status, "result": result, "task_id": task_id}
+        )
+        await redis.set(backend.task_keyprefix + task_id.encode(), payload)
+        await redis.publish(backend.task_keyprefix + task_id.encode(), payload)
+
+    async def run():
+        redis = fakeredis.aioredis.FakeRedis(server=server)
+        waiter = ResultWaiter(ml_tasks.app)
+        await waiter.start()
+        await store(redis, "t1", "SUCCESS", 1)
+
+        async def complete_later():
+            await asyncio.sleep(0.1)
+            await store(redis, "t2", "PROGRESS", {"current": 50, "total": 100})
+            await store(redis, "t2", "SUCCESS", 2)
+
+        asyncio.create_task(complete_later())
+        updates = [
+            (task["task_id"], task["status"], task["result"])
+            async for task in waiter.watch(["t1", "t2"], heartbeat=0.05)
+            if task is not None
+        ]
+        info = waiter.info()
+        await waiter.stop()
+        return updates, info
+
+    updates, info = asyncio.run(run())
+    assert updates == [
+        ("t1", "SUCCESS", 1),
+        ("t2", "PENDING", None),
+        ("t2", "PROGRESS", {"current": 50, "total": 100}),
+        ("t2", "SUCCESS", 2),
+    ]
+    assert info["pending"] == 0
+
+
+def test_read_workflow(server):
+    backend = ml_tasks.app.backend
+    keys = workflow.Keys("w1")
+
+    async def run():
+        redis = fakeredis.aioredis.FakeRedis(server=server)
+        spec = tasks.video_workflow("input.mp4").spec()
+        await redis.set(keys.spec, json.dumps(spec))
+        await redis.hset(
+            keys.tasks,
+            mapping={"convert": "c", "analyze": "a", "mark": "m", "clip:0": "c0"},
+        )
+        await redis.hset(keys.sizes, "clip", 2)
+        for task_id, meta in [
+            ("w1", {"status": "STARTED", "result": None}),
+            ("c", {"status": "SUCCESS", "result": "input.out.mp4"}),
+            ("a", {"status": "SUCCESS", "result": [3, 7]}),
+            ("c0", {"status": "SUCCESS", "result": "input.out.3.mp4"}),
+        ]:
+            payload = backend.encode({**meta, "task_id": task_id})
+            await redis.set(backend.task_keyprefix + task_id.encode(), payload)
+
+        waiter = ResultWaiter(ml_tasks.app)
+        await waiter.start()
+        state = await waiter.read_workflow("w1")
+        missing = await waiter.read_workflow("w2")
+        await waiter.stop()
+        return state, missing
+
+    state, missing = asyncio.run(run())
+    assert missing is None
+    assert state["status"] == "STARTED"
+    assert state["progress"] == (1 + 1 + 0 + 0.5) / 4
+    nodes = {node["node"]: node for node in state["nodes"]}
+    assert nodes["convert"]["result"] == "input.out.mp4"
+    assert (nodes["mark"]["status"], nodes["mark"]["result"]) == ("STARTED", None)
+    assert nodes["clip"]["status"] == "STARTED"
+    assert nodes["clip"]["parents"] == ["convert", "analyze"]
+    assert [task["task_id"] for task in nodes["clip"]["tasks"]] == ["c0"]
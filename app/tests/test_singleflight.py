@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_single_flight():
+    calls = []
+
+    async def predict(msg):
+        calls.append(msg)
+        await asyncio.sleep(0.05)
+        if msg == "bad":
+            raise ValueError(msg)
+        return msg.upper()
+
+    async def run():
+        flights = SingleFlight()
+        results = await asyncio.gather(
+            *[flights.do("a", lambda: predict("a")) for _ in range(8)],
+            flights.do("b", lambda: predict("b")),
+        )
+        assert results == ["A"] * 8 + ["B"]
+
+        # The first caller going away does not cancel the others
+        first = asyncio.create_task(flights.do("c", lambda: predict("c")))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(flights.do("c", lambda: predict("c")))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "C"
+
+        with pytest.raises(ValueError):
+            await asyncio.gather(
+                *[flights.do("d", lambda: predict("bad")) for _ in range(2)]
+            )
+
+        # Done calls are not shared
+        assert await flights.do("a", lambda: predict("a")) == "A"
+        return flights.info()
+
+    info = asyncio.run(run())
+    assert calls == ["a", "b", "c", "bad", "a"]
+    assert info == {
+        "calls": 5,
+        "coalesced": 9,
+        "in_flight": 0,
+        "coalescing_ratio": 9 / 14,
+    }